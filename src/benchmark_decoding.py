@@ -0,0 +1,108 @@
+import argparse
+import json
+import time
+import records
+
+
+# How chunks were decoded before: to a string first, then line by line with json
+def decode_with_json(chunks, fields):
+    texts = []
+    for chunk in chunks:
+        for line in chunk.decode("utf-8").split("\n"):
+            if line.strip():
+                texts.append(records.get_record_text(json.loads(line), fields))
+    return texts
+
+
+def decode_text_chunks(chunks, fields):
+    texts = []
+    for chunk in chunks:
+        texts += records.decode_texts(
+            records.get_record_lines(chunk.decode("utf-8")), fields
+        )
+    return texts
+
+
+# Decode chunks of bytes like the workers of compute_frequencies.py do
+def decode_byte_chunks(chunks, fields):
+    texts = []
+    for chunk in chunks:
+        texts += records.decode_texts(records.get_record_lines(chunk), fields)
+    return texts
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Compare the throughput of decoding the JSON lines of a corpus line by line and in chunks of bytes."
+    )
+    parser.add_argument(
+        "file_name",
+        type=str,
+        nargs="?",
+        default="../data/zhihu/web_text_zh_small.json",
+        help="JSON lines file to decode, defaults to the small Zhihu sample.",
+    )
+    parser.add_argument(
+        "--fields",
+        type=str,
+        nargs="+",
+        default=["title", "desc", "content"],
+        help="Fields of each record to extract, defaults to the Zhihu fields.",
+    )
+    parser.add_argument(
+        "-n",
+        "--lines",
+        type=int,
+        default=100000,
+        help="Number of lines to decode, the file is repeated if it has fewer lines. Defaults to 100000.",
+    )
+    parser.add_argument(
+        "--chunk-lines",
+        type=int,
+        default=1000,
+        help="Lines in every chunk of bytes, defaults to 1000.",
+    )
+    args = parser.parse_args()
+
+    with open(args.file_name, "r") as f:
+        file_lines = [line for line in f if line.strip()]
+    lines = [file_lines[i % len(file_lines)] for i in range(args.lines)]
+    chunks = [
+        "".join(
+            line.rstrip("\n") + "\n" for line in lines[i : i + args.chunk_lines]
+        ).encode("utf-8")
+        for i in range(0, len(lines), args.chunk_lines)
+    ]
+    num_bytes = sum(len(chunk) for chunk in chunks)
+    print(
+        "Decoding {} lines ({:.1f} MB) with {}".format(
+            len(lines), num_bytes / 1e6, records.get_parser_name()
+        )
+    )
+
+    reference = None
+    print("Parser, input\tLines/s\tMB/s")
+    for (name, decode) in [
+        ("json, text", lambda: decode_with_json(chunks, args.fields)),
+        (
+            "{}, text".format(records.get_parser_name()),
+            lambda: decode_text_chunks(chunks, args.fields),
+        ),
+        (
+            "{}, bytes".format(records.get_parser_name()),
+            lambda: decode_byte_chunks(chunks, args.fields),
+        ),
+    ]:
+        time_start = time.time()
+        texts = decode()
+        seconds = time.time() - time_start
+        if reference is None:
+            reference = texts
+        elif texts != reference:
+            print("{} decoded different texts".format(name))
+        print(
+            "{}\t{:.0f}\t{:.2f}".format(
+                name, len(lines) / seconds, num_bytes / seconds / 1e6
+            ),
+            flush=True,
+        )
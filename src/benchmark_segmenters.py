@@ -0,0 +1,138 @@
+import argparse
+import time
+from compute_frequencies import (
+    default_segment_batch_size,
+    get_words_components,
+    use_segmenter,
+)
+from frequency_profiles import get_percentages
+from records import decode_texts
+from segmenters import segmenter_names
+from symbols import (
+    ArrayFreqs,
+    count_component_lines,
+    get_single_counts,
+    get_pair_counts,
+)
+from word_cache import WordCache
+
+
+def get_max_delta(percentages: dict, reference_percentages: dict) -> tuple:
+    return max(
+        (
+            (
+                abs(percentages.get(key, 0) - reference_percentages.get(key, 0)),
+                key,
+            )
+            for key in set(percentages).union(reference_percentages)
+        ),
+        default=(0.0, None),
+    )
+
+
+def format_key(key) -> str:
+    return "+".join(key) if isinstance(key, tuple) else str(key)
+
+
+# Run one segmenter over the lines in this process and time it,
+# the lines go through the same batched stages as in compute_frequencies.process_text
+def benchmark_segmenter(name, lines, fields, word_cache_size, segment_batch_size):
+    segmenter = use_segmenter(name)
+    cache = (
+        WordCache(word_cache_size)
+        if word_cache_size > 0 and segmenter.segments_words
+        else None
+    )
+    freqs = ArrayFreqs()
+    time_start = time.time()
+    texts = decode_texts(lines, fields)
+    if segmenter.segments_words:
+        line_words = list(segmenter.segment_texts(texts, segment_batch_size))
+    else:
+        # pypinyin segments the whole text of every line itself
+        line_words = texts
+    count_component_lines(
+        [get_words_components(words, cache) for words in line_words], freqs
+    )
+    return (time.time() - time_start, freqs)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Compare the throughput and resulting frequencies of the word segmenters."
+    )
+    parser.add_argument(
+        "file_name",
+        type=str,
+        nargs="?",
+        default="../data/zhihu/web_text_zh_small.json",
+        help="JSON lines file to segment, defaults to the small Zhihu sample.",
+    )
+    parser.add_argument(
+        "--fields",
+        type=str,
+        nargs="+",
+        default=["title", "desc", "content"],
+        help="Fields of each record to process, defaults to the Zhihu fields.",
+    )
+    parser.add_argument(
+        "-n",
+        "--lines",
+        type=int,
+        default=10000,
+        help="Number of lines to process, the file is repeated if it has fewer lines. Defaults to 10000.",
+    )
+    parser.add_argument(
+        "--segmenters",
+        type=str,
+        nargs="+",
+        choices=segmenter_names,
+        default=segmenter_names,
+        help="Segmenters to compare, the first one is the reference for the frequency deltas.",
+    )
+    parser.add_argument(
+        "--word-cache-size",
+        type=int,
+        default=0,
+        help="Size of the word cache during the benchmark, defaults to 0 (no cache).",
+    )
+    parser.add_argument(
+        "--segment-batch-size",
+        type=int,
+        default=default_segment_batch_size,
+        help="Number of lines handed to the segmenter at once, defaults to {}.".format(
+            default_segment_batch_size
+        ),
+    )
+    args = parser.parse_args()
+
+    with open(args.file_name, "r") as f:
+        file_lines = [line for line in f if line.strip()]
+    lines = [file_lines[i % len(file_lines)] for i in range(args.lines)]
+    num_chars = sum(len(line) for line in lines)
+    print("Benchmarking {} lines ({} characters)".format(len(lines), num_chars))
+
+    reference = None
+    print("Segmenter\tLines/s\tChars/s\tMax single delta\tMax pair delta")
+    for name in args.segmenters:
+        (seconds, freqs) = benchmark_segmenter(
+            name, lines, args.fields, args.word_cache_size, args.segment_batch_size
+        )
+        single_percentages = get_percentages(get_single_counts(freqs))
+        pair_percentages = get_percentages(get_pair_counts(freqs))
+        if reference is None:
+            reference = (single_percentages, pair_percentages)
+        (single_delta, single_key) = get_max_delta(single_percentages, reference[0])
+        (pair_delta, pair_key) = get_max_delta(pair_percentages, reference[1])
+        print(
+            "{}\t{:.0f}\t{:.0f}\t{:.4f} ({})\t{:.4f} ({})".format(
+                name,
+                len(lines) / seconds,
+                num_chars / seconds,
+                single_delta,
+                format_key(single_key),
+                pair_delta,
+                format_key(pair_key),
+            ),
+            flush=True,
+        )
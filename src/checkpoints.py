@@ -0,0 +1,112 @@
+import json
+import os
+import numpy as np
+from typing import Optional
+from symbols import ArrayFreqs, array_freqs_from_arrays, save_array_freqs
+
+# A checkpoint directory holds the counts of every chunk that has been processed,
+# one .npz file per chunk, and a manifest of the run the chunks belong to.
+# Several runs (on different nodes) can share a directory as long as their
+# manifests match.
+
+manifest_name = "manifest.json"
+
+
+# A checkpoint directory that cannot be used for the run
+class CheckpointError(ValueError):
+    pass
+
+
+def get_chunk_checkpoint_path(checkpoint_dir: str, chunk_index: int) -> str:
+    return os.path.join(checkpoint_dir, "chunk_{:06d}.npz".format(chunk_index))
+
+
+# Write to a temporary file first so that an interrupted write never
+# leaves a partial file behind that looks like a finished one
+def replace_file(path: str, write):
+    temporary_path = "{}.{}.tmp".format(path, os.getpid())
+    with open(temporary_path, "wb") as outfile:
+        write(outfile)
+    os.replace(temporary_path, path)
+
+
+# Prepare the checkpoint directory and return the indices of the chunks it already
+# holds. Resuming requires the manifest of the directory to match `manifest`.
+def open_checkpoint_dir(checkpoint_dir: str, manifest: dict, resume: bool) -> set[int]:
+    os.makedirs(checkpoint_dir, exist_ok=True)
+    manifest_path = os.path.join(checkpoint_dir, manifest_name)
+    if os.path.exists(manifest_path):
+        if not resume:
+            raise CheckpointError(
+                "{} already holds a checkpoint, resume it or use another directory".format(
+                    checkpoint_dir
+                )
+            )
+        with open(manifest_path, "r") as infile:
+            previous_manifest = json.load(infile)
+        # Compare what was written, JSON turns tuples into lists
+        if previous_manifest != json.loads(json.dumps(manifest)):
+            raise CheckpointError(
+                "The checkpoint in {} was made for a different input or different options".format(
+                    checkpoint_dir
+                )
+            )
+    else:
+        replace_file(
+            manifest_path,
+            lambda outfile: outfile.write(json.dumps(manifest).encode("utf-8")),
+        )
+    return get_checkpointed_chunks(checkpoint_dir)
+
+
+def get_checkpointed_chunks(checkpoint_dir: str) -> set[int]:
+    return {
+        int(name[len("chunk_") : -len(".npz")])
+        for name in os.listdir(checkpoint_dir)
+        if name.startswith("chunk_") and name.endswith(".npz")
+    }
+
+
+def save_chunk_checkpoint(
+    checkpoint_dir: str,
+    chunk_index: int,
+    freqs: ArrayFreqs,
+    word_cache_hits: int = 0,
+    word_cache_misses: int = 0,
+):
+    replace_file(
+        get_chunk_checkpoint_path(checkpoint_dir, chunk_index),
+        lambda outfile: save_array_freqs(
+            outfile,
+            freqs,
+            word_cache_hits=np.int64(word_cache_hits),
+            word_cache_misses=np.int64(word_cache_misses),
+        ),
+    )
+
+
+# The counts and the word cache hits and misses of a chunk
+def load_chunk_checkpoint(
+    checkpoint_dir: str, chunk_index: int
+) -> tuple[ArrayFreqs, int, int]:
+    with np.load(get_chunk_checkpoint_path(checkpoint_dir, chunk_index)) as arrays:
+        return (
+            array_freqs_from_arrays(arrays),
+            int(arrays["word_cache_hits"]),
+            int(arrays["word_cache_misses"]),
+        )
+
+
+def parse_part(part: str) -> tuple[int, int]:
+    (index, count) = map(int, part.split("/"))
+    if not 0 < index <= count:
+        raise ValueError(
+            'Expected a part like "2/4" (the second of four), got "{}"'.format(part)
+        )
+    return (index - 1, count)
+
+
+# Part (index, count) of a run split into `count` jobs processes every
+# count-th chunk starting from `index`
+def is_in_part(chunk_index: int, part: Optional[tuple[int, int]]) -> bool:
+    return part is None or chunk_index % part[1] == part[0]
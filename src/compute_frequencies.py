@@ -1,18 +1,85 @@
 import json
-import re
-from pypinyin import lazy_pinyin
 import multiprocessing as mp
 import os
-import sys
+import mmap
 import argparse
+import sys
+import threading
+import time
+import numpy as np
 from dataclasses import dataclass, field
-from collections import defaultdict
-from typing import TypeAlias
-from spacy.lang.zh import Chinese
+from collections import Counter, defaultdict
+from functools import partial
+from typing import Callable, TypeAlias, Optional, Union
 from utils import measure
-
-initial_regex = re.compile("(ch|zh|sh|r|c|b|d|g|f|h|k|j|m|l|n|q|p|s|t|w|y|x|z)")
-
+from checkpoints import (
+    CheckpointError,
+    get_checkpointed_chunks,
+    is_in_part,
+    load_chunk_checkpoint,
+    open_checkpoint_dir,
+    parse_part,
+    save_chunk_checkpoint,
+)
+from corpus_files import (
+    compression_extensions,
+    find_input_file,
+    get_compression,
+    iter_text_chunks,
+    load_block_index,
+    read_data,
+)
+from segmenters import Segmenter, create_segmenter, segmenter_classes, segmenter_names
+from ngrams import NgramCounts, get_max_ngram_size
+from syllables import (
+    get_pinyin_characters,
+    get_syllable_table,
+    get_toned_syllable_table,
+    split_syllables,
+    split_toned_syllables,
+    take_unknown_syllables,
+)
+from text_counts import TextCounts, count_text
+from frequency_profiles import get_percentages
+from records import decode_text, decode_texts, get_record_lines
+from pipeline_stats import (
+    PipelineStats,
+    StageStats,
+    add_worker_stats,
+    get_stats_report,
+    lap,
+    print_stats_report,
+    save_stats_report,
+)
+from sketches import CountMinSketch, get_sketch_error, get_sketch_width
+from symbols import (
+    ArrayFreqs,
+    symbol_table,
+    count_component_lines,
+    add_array_freqs,
+    get_single_counts,
+    get_pair_counts,
+    get_ngram_counts,
+    load_array_freqs,
+    save_array_freqs,
+)
+from sampling import (
+    SampleOptions,
+    SampleStats,
+    add_sample_stats,
+    count_sample_lines,
+    estimate_pair_percentages,
+    estimate_single_percentages,
+    get_confidence_intervals,
+    get_line_ranges,
+)
+from word_cache import (
+    Components,
+    WordCache,
+    load_word_cache,
+    save_word_cache,
+    get_hit_rate,
+)
 
 SingleFreqs: TypeAlias = dict[str, int]
 PairFreqs: TypeAlias = dict[tuple[str, str], int]
@@ -24,137 +91,727 @@ class Freqs:
     pair_freqs: PairFreqs = field(default_factory=lambda: defaultdict(int))
 
 
-# PKUSeg with "mixed" model provided by pkuseg
-cfg = {"segmenter": "pkuseg"}
-nlp = Chinese.from_config({"nlp": {"tokenizer": cfg}})
-nlp.tokenizer.initialize(pkuseg_model="mixed")
+# Number of words each worker keeps in its word cache
+default_word_cache_size = 100000
+
+# Number of distinct n-grams each worker keeps when counting n-grams
+default_max_ngrams = 1000000
+
+# Rows of the Count-Min sketch, its error bound holds with probability 1 - e^-depth
+default_sketch_depth = 4
+
+# Lines segmented at once, see Segmenter.segment_texts
+default_segment_batch_size = 1000
+
+# Size in bytes of the chunks handed out to the workers. Many small chunks
+# keep every worker busy until the end instead of waiting on the slowest chunk.
+default_chunk_size = 4 * 1024 * 1024
+
+
+@dataclass
+class CountOptions:
+    # Segmenter backend, one of segmenter_names
+    segmenter: str = "pkuseg"
+    # Word list for the "maxmatch" segmenter, defaults to pypinyin's phrases
+    dictionary_path: Optional[str] = None
+    word_cache_size: int = default_word_cache_size
+    word_cache_path: Optional[str] = None
+    # Number of worker processes, defaults to the CPU count
+    workers: Optional[int] = None
+    chunk_size: int = default_chunk_size
+    # Directory the counts of every chunk are saved to as soon as it is done
+    checkpoint_dir: Optional[str] = None
+    # Skip the chunks already in the checkpoint directory
+    resume: bool = False
+    # Only process part (index, count) of the chunks, see checkpoints.is_in_part.
+    # The parts share the checkpoint directory and a run without a part merges them.
+    part: Optional[tuple[int, int]] = None
+    # Length of the n-grams to count besides singles and pairs, 0 counts none
+    ngram_size: int = 0
+    # Only the most frequent n-grams are kept, None keeps all of them
+    max_ngrams: Optional[int] = default_max_ngrams
+    # Number of lines the segmenter is handed at once
+    segment_batch_size: int = default_segment_batch_size
+    # Width of the Count-Min sketch the n-grams of the whole file are counted in,
+    # 0 counts them exactly (up to max_ngrams per worker)
+    sketch_width: int = 0
+    sketch_depth: int = default_sketch_depth
+    # Also count initials and toned finals, see text_counts.TextCounts
+    tones: bool = False
+    # Also count syllables and characters
+    characters: bool = False
+
+
+# Counts of a single chunk. With a sketch the chunks count their n-grams exactly
+# and only the result they are added to is sketched.
+def get_empty_counts(options: CountOptions) -> ArrayFreqs:
+    counts = ArrayFreqs()
+    if options.ngram_size != 0:
+        counts.ngram_counts = NgramCounts(
+            options.ngram_size,
+            len(symbol_table),
+            options.max_ngrams if options.sketch_width == 0 else None,
+        )
+    if options.tones or options.characters:
+        counts.text_counts = TextCounts(options.tones, options.characters)
+    return counts
+
+
+def get_result_counts(options: CountOptions) -> ArrayFreqs:
+    if options.ngram_size == 0 or options.sketch_width == 0:
+        return ArrayFreqs()
+    return ArrayFreqs(
+        ngram_counts=NgramCounts(
+            options.ngram_size,
+            len(symbol_table),
+            options.max_ngrams,
+            sketch=CountMinSketch(options.sketch_width, options.sketch_depth),
+        )
+    )
+
+
+# The segmenter of this process and the options it was created with.
+# Segmentation models take seconds to load, so the segmenter is only created
+# on first use instead of when this module is imported.
+segmenter: Optional[Segmenter] = None
+segmenter_options: Optional[tuple[str, Optional[str]]] = None
+
+
+def use_segmenter(name: str = "pkuseg", dictionary_path: Optional[str] = None):
+    global segmenter, segmenter_options
+    if segmenter is None or segmenter_options != (name, dictionary_path):
+        segmenter = create_segmenter(name, dictionary_path)
+        segmenter_options = (name, dictionary_path)
+    return segmenter
+
+
+def get_segmenter() -> Segmenter:
+    return segmenter if segmenter is not None else use_segmenter()
+
+
+# Converters of text to syllables without and with tones (eg. "zhong1", 5 for the
+# neutral tone). pypinyin takes a moment to import, so like the segmenter they are
+# bound on first use instead of when this module is imported.
+pinyin: Optional[Callable[..., list[str]]] = None
+toned_pinyin: Optional[Callable[..., list[str]]] = None
+
+
+def use_pinyin():
+    global pinyin, toned_pinyin
+    if pinyin is None:
+        from pypinyin import Style, lazy_pinyin
+
+        pinyin = partial(lazy_pinyin, errors="ignore")
+        toned_pinyin = partial(
+            lazy_pinyin, style=Style.TONE3, neutral_tone_with_five=True, errors="ignore"
+        )
+
+
+def get_pinyin() -> Callable[..., list[str]]:
+    if pinyin is None:
+        use_pinyin()
+    return pinyin
+
+
+def get_toned_pinyin() -> Callable[..., list[str]]:
+    if toned_pinyin is None:
+        use_pinyin()
+    return toned_pinyin
+
+
+# Initializer of the worker processes, loads the segmenter and pypinyin, builds
+# the syllable table and warms the word cache exactly once per process, so that
+# none of it is timed as part of the first chunk
+def init_worker(options: CountOptions):
+    use_segmenter(options.segmenter, options.dictionary_path)
+    use_pinyin()
+    if options.tones:
+        get_toned_syllable_table()
+    else:
+        get_syllable_table()
+    if segmenter_classes[options.segmenter].segments_words:
+        get_word_cache(options.word_cache_size, options.word_cache_path)
 
 
 def segment_words(line):
-    return list(map(lambda token: token.text, nlp(line)))
+    return get_segmenter().segment(line)
 
 
 def process_line(line, fields):
     freqs = Freqs()
-    data = json.loads(line)
-    pinyins = lazy_pinyin(
-        segment_words(" ".join(map(lambda field: data[field], fields))), errors="ignore"
-    )
-    seq = []
-    for pinyin in pinyins:
-        match_result = initial_regex.match(pinyin)
-        if match_result:
-            initial = match_result.groups()[0]
-            final = pinyin[len(initial) :]
-            freqs.single_freqs[initial] += 1
-            seq.append(initial)
-            if len(final) > 0:
-                freqs.single_freqs[final] += 1
-                seq.append(final)
-        else:
-            final = pinyin + "F"
-            freqs.single_freqs[final] += 1
-            seq.append(final)
+    count_line(line, fields, freqs)
+    return freqs
 
-    for i, component in enumerate(seq):
-        if i < len(seq) - 1:
-            next = seq[i + 1]
-            freqs.pair_freqs[(component, next)] += 1
 
-    return freqs
+# Split the Pinyin of a line into its sequence of initials and finals
+# When a word cache is given, each segmented word is converted on its own
+# and its components are looked up in the cache first
+# When `stats` are given, the time of every stage is added to them
+def get_components(
+    line,
+    fields,
+    cache: Optional[WordCache] = None,
+    stats: Optional[StageStats] = None,
+) -> list[str]:
+    start = time.perf_counter()
+    text = decode_text(line, fields)
+    lap(stats, "decode", start)
+    return get_text_components(text, cache, stats)
+
+
+# Same as get_components for the text of the fields of a decoded line
+def get_text_components(
+    text: str, cache: Optional[WordCache] = None, stats: Optional[StageStats] = None
+) -> list[str]:
+    start = time.perf_counter()
+    if not get_segmenter().segments_words:
+        pinyins = get_pinyin()(text)
+        start = lap(stats, "pinyin", start)
+        components = split_syllables(pinyins)
+        lap(stats, "split", start)
+        return components
+    words = segment_words(text)
+    lap(stats, "segmentation", start)
+    return get_words_components(words, cache, stats)
+
+
+# Same as get_components for the segmented words of a line, or for
+# the whole text of the line when pypinyin segments it itself
+def get_words_components(
+    words: Union[str, list[str]],
+    cache: Optional[WordCache] = None,
+    stats: Optional[StageStats] = None,
+) -> list[str]:
+    if cache is None:
+        start = time.perf_counter()
+        pinyins = get_pinyin()(words)
+        start = lap(stats, "pinyin", start)
+        components = split_syllables(pinyins)
+        lap(stats, "split", start)
+        return components
+    components = []
+    for word in words:
+        components += get_word_components(word, cache, stats)
+    return components
+
+
+def get_word_components(
+    word: str, cache: WordCache, stats: Optional[StageStats] = None
+) -> Components:
+    components = cache.get(word)
+    if components is None:
+        start = time.perf_counter()
+        # A list input keeps pypinyin from segmenting the word again
+        pinyins = get_pinyin()([word])
+        start = lap(stats, "pinyin", start)
+        components = tuple(split_syllables(pinyins))
+        lap(stats, "split", start)
+        cache.put(word, components)
+    return components
+
+
+# Toned syllables of the words of a line (eg. "zhong1", 5 for the neutral tone).
+# `words` is the whole text when pypinyin segments it itself.
+def get_toned_syllables(
+    words: Union[str, list[str]],
+    cache: Optional[WordCache] = None,
+    stats: Optional[StageStats] = None,
+) -> list[str]:
+    start = time.perf_counter()
+    if cache is None:
+        syllables = get_toned_pinyin()(words)
+    else:
+        syllables = []
+        for word in words:
+            word_syllables = cache.get(word)
+            if word_syllables is None:
+                word_syllables = tuple(get_toned_pinyin()([word]))
+                cache.put(word, word_syllables)
+            syllables += word_syllables
+    lap(stats, "pinyin", start)
+    return syllables
+
+
+# Convert a line to toned syllables, add them to `text_counts`
+# and return the initials and finals of the line
+def count_line_text(
+    text: str,
+    words: Union[str, list[str]],
+    text_counts: TextCounts,
+    cache: Optional[WordCache] = None,
+    stats: Optional[StageStats] = None,
+) -> list[str]:
+    syllables = get_toned_syllables(words, cache, stats)
+    start = time.perf_counter()
+    (components, toned_components) = split_toned_syllables(syllables)
+    start = lap(stats, "split", start)
+    count_text(
+        get_pinyin_characters(text) if text_counts.characters else [],
+        syllables,
+        toned_components,
+        text_counts,
+    )
+    lap(stats, "counting", start)
+    return components
+
+
+# Count the initials and finals of a line directly into `freqs`
+def count_line(line, fields, freqs: Freqs):
+    components = get_components(line, fields)
+    for i, component in enumerate(components):
+        freqs.single_freqs[component] += 1
+        if i > 0:
+            freqs.pair_freqs[(components[i - 1], component)] += 1
+
+
+@dataclass
+class ChunkResult:
+    freqs: ArrayFreqs
+    word_cache_hits: int = 0
+    word_cache_misses: int = 0
+    # Words the worker converted during the chunk, only returned when the cache is persisted
+    word_cache_entries: dict[str, Components] = field(default_factory=dict)
+    # Syllables that could not be split into an initial and a final
+    unknown_syllables: dict[str, int] = field(default_factory=dict)
+    stats: StageStats = field(default_factory=StageStats)
+    # Worker process the chunk was processed by
+    pid: int = field(default_factory=os.getpid)
+
+
+def parallel_read(file_name, fields, options: Optional[CountOptions] = None) -> Freqs:
+    return get_freqs(parallel_count(file_name, fields, options))
+
+
+def get_freqs(counts: ArrayFreqs) -> Freqs:
+    return Freqs(get_single_counts(counts), get_pair_counts(counts))
 
 
 # Source: https://nurdabolatov.com/parallel-processing-large-file-in-python
-def parallel_read(file_name, fields):
-    # Maximum number of processes we can run at a time
-    cpu_count = mp.cpu_count()
-    print("CPU count: {}".format(cpu_count))
+# When `stats` are given, the time spent in every stage of the pipeline is added to them
+def parallel_count(
+    file_name,
+    fields,
+    options: Optional[CountOptions] = None,
+    stats: Optional[PipelineStats] = None,
+) -> ArrayFreqs:
+    run_start = time.perf_counter()
+    stats = PipelineStats() if stats is None else stats
+    options = CountOptions() if options is None else options
+    workers = options.workers if options.workers is not None else mp.cpu_count()
+    print("Workers: {}".format(workers))
 
     file_size = os.path.getsize(file_name)
-    chunk_size = file_size // cpu_count
+    chunk_size = options.chunk_size
     print("Source file size: {}".format(file_size))
-    print("Operating on chunk size of {}".format(chunk_size))
-
-    # Arguments for each chunk (eg. [('input.txt', 0, 32), ('input.txt', 32, 64)])
-    chunk_args = []
-    with open(file_name, "rb") as f:
-
-        def is_start_of_line(position):
-            if position == 0:
-                return True
-            # Check whether the previous character is EOL
-            f.seek(position - 1)
-            previous_byte = int.from_bytes(f.read(1), byteorder=sys.byteorder)
-            # 0b0xxxxxxx is the format of an ASCII character
-            previous_is_ascii = not (previous_byte & 0x80)
-            # If the previous character is an ASCII character, we check if it is EOL
-            if previous_is_ascii and previous_byte == ord("\n"):
-                # print("Found start of line at {}".format(position))
-                return True
-            # else we can't be at the start of a line
+
+    compression = get_compression(file_name)
+    block_index = load_block_index(file_name) if compression is not None else None
+    if compression is None:
+        print("Operating on chunk size of {}".format(chunk_size))
+        chunk_boundaries = get_chunk_boundaries(file_name, chunk_size)
+    elif block_index is not None:
+        # The independently compressed blocks are the chunks
+        print("Operating on the compressed blocks of the {} file".format(compression))
+        chunk_boundaries = block_index
+    else:
+        # Without a block index the file can only be decompressed from the start,
+        # so this process decompresses it and the workers process the text
+        print(
+            "No block index for the {} file, decompressing it in the main process".format(
+                compression
+            )
+        )
+        chunk_boundaries = None
+    if chunk_boundaries is not None:
+        print("Identified {} chunks".format(len(chunk_boundaries)))
+
+    checkpointed_chunks: set[int] = set()
+    if options.checkpoint_dir is not None:
+        manifest = {
+            "file_name": os.path.basename(file_name),
+            "file_size": file_size,
+            "fields": fields,
+            "segmenter": options.segmenter,
+            "dictionary_path": options.dictionary_path,
+            "chunk_size": chunk_size if block_index is None else None,
+            "chunks": chunk_boundaries,
+            "ngram_size": options.ngram_size,
+            "max_ngrams": options.max_ngrams,
+            "sketch_width": options.sketch_width,
+            "sketch_depth": options.sketch_depth,
+            "tones": options.tones,
+            "characters": options.characters,
+        }
+        checkpointed_chunks = open_checkpoint_dir(
+            options.checkpoint_dir,
+            manifest,
+            options.resume or options.part is not None,
+        )
+        if checkpointed_chunks:
+            print(
+                "Skipping {} chunks already in {}".format(
+                    len(checkpointed_chunks), options.checkpoint_dir
+                )
+            )
+
+    def is_pending(chunk_index):
+        return chunk_index not in checkpointed_chunks and is_in_part(
+            chunk_index, options.part
+        )
+
+    # Indices of all chunks of the file, known once the tasks have been handed out
+    chunk_indices = []
+    if chunk_boundaries is not None:
+        chunk_indices = list(range(len(chunk_boundaries)))
+        # Arguments for each chunk (eg. [('input.txt', 0, 32), ('input.txt', 32, 64)])
+        tasks = [
+            (chunk_index, (file_name, fields, chunk_start, chunk_end, options))
+            for (chunk_index, (chunk_start, chunk_end)) in enumerate(chunk_boundaries)
+            if is_pending(chunk_index)
+        ]
+        (process, num_tasks, pending_tasks) = (process_chunk_task, len(tasks), None)
+    else:
+
+        def get_text_tasks():
+            for (chunk_index, text) in enumerate(
+                iter_text_chunks(file_name, chunk_size)
+            ):
+                chunk_indices.append(chunk_index)
+                if is_pending(chunk_index):
+                    yield (chunk_index, (fields, text, options))
+
+        # The pool would otherwise decompress the whole file into its task queue
+        pending_tasks = threading.BoundedSemaphore(2 * workers)
+        tasks = throttle(get_text_tasks(), pending_tasks)
+        (process, num_tasks) = (process_text_task, None)
+
+    result = get_result_counts(options)
+    word_cache_hits = 0
+    word_cache_misses = 0
+    merged_word_cache = WordCache(options.word_cache_size)
+    merged_word_cache.update(
+        load_word_cache(options.word_cache_path, options.word_cache_size).entries
+    )
+    processed_chunks = set()
+    unknown_syllables: Counter = Counter()
+    with mp.Pool(workers, initializer=init_worker, initargs=(options,)) as p:
+        # Idle workers take the next chunk, and the chunk results are
+        # combined into `result` in whatever order they finish
+        for (i, (chunk_index, chunk_result)) in enumerate(
+            p.imap_unordered(process, tasks)
+        ):
+            if pending_tasks is not None:
+                pending_tasks.release()
+            if options.checkpoint_dir is not None:
+                save_chunk_checkpoint(
+                    options.checkpoint_dir,
+                    chunk_index,
+                    chunk_result.freqs,
+                    chunk_result.word_cache_hits,
+                    chunk_result.word_cache_misses,
+                )
+            processed_chunks.add(chunk_index)
+            start = time.perf_counter()
+            add_array_freqs(result, chunk_result.freqs)
+            lap(stats.main, "merge", start)
+            add_worker_stats(stats, chunk_result.pid, chunk_result.stats)
+            word_cache_hits += chunk_result.word_cache_hits
+            word_cache_misses += chunk_result.word_cache_misses
+            merged_word_cache.update(chunk_result.word_cache_entries)
+            unknown_syllables.update(chunk_result.unknown_syllables)
+            if num_tasks is not None:
+                print("Processed {}/{} chunks".format(i + 1, num_tasks))
             else:
-                return False
+                print("Processed {} chunks".format(i + 1))
 
-        def get_next_line_position(position):
-            # Read the current line till the end
-            f.seek(position)
-            f.readline()
-            # Return a position after reading the line
-            return f.tell()
+    # A part only checkpoints its own chunks and its counts are not saved,
+    # the final run with --resume merges all of them
+    if options.checkpoint_dir is not None and options.part is None:
+        # Merge the chunks of previous runs and of the other parts done by now
+        checkpointed_chunks = (
+            get_checkpointed_chunks(options.checkpoint_dir) - processed_chunks
+        )
+        for chunk_index in sorted(checkpointed_chunks):
+            start = time.perf_counter()
+            (chunk_freqs, hits, misses) = load_chunk_checkpoint(
+                options.checkpoint_dir, chunk_index
+            )
+            add_array_freqs(result, chunk_freqs)
+            lap(stats.main, "merge", start)
+            word_cache_hits += hits
+            word_cache_misses += misses
+        missing_chunks = set(chunk_indices) - processed_chunks - checkpointed_chunks
+        if missing_chunks:
+            print(
+                "{} of {} chunks are not done yet, the frequencies are incomplete".format(
+                    len(missing_chunks), len(chunk_indices)
+                )
+            )
+    if unknown_syllables:
+        print(
+            "Left out {} unknown syllables: {}".format(
+                sum(unknown_syllables.values()),
+                ", ".join(
+                    "{} ({})".format(syllable, count)
+                    for syllable, count in unknown_syllables.most_common(20)
+                ),
+            )
+        )
+    # The word cache is not used when pypinyin segments the text itself
+    if (
+        options.word_cache_size > 0
+        and segmenter_classes[options.segmenter].segments_words
+    ):
+        print(
+            "Word cache hit rate: {:.2f}% ({} hits, {} misses)".format(
+                get_hit_rate(word_cache_hits, word_cache_misses),
+                word_cache_hits,
+                word_cache_misses,
+            )
+        )
+        if options.word_cache_path is not None:
+            save_word_cache(merged_word_cache, options.word_cache_path)
+            print(
+                "Saved {} cached words to {}".format(
+                    len(merged_word_cache.entries), options.word_cache_path
+                )
+            )
+    stats.wall_seconds += time.perf_counter() - run_start
+    return result
 
+
+# Split the file into (start, end) byte ranges of about `chunk_size` bytes
+# that each end right after a newline (or at the end of the file)
+def get_chunk_boundaries(file_name, chunk_size) -> list[tuple[int, int]]:
+    file_size = os.path.getsize(file_name)
+    # Empty files cannot be memory-mapped
+    if file_size == 0:
+        return []
+    boundaries = []
+    with open(file_name, "rb") as f, mmap.mmap(
+        f.fileno(), 0, access=mmap.ACCESS_READ
+    ) as mm:
         chunk_start = 0
-        # Iterate over all chunks and construct arguments for `process_chunk`
         while chunk_start < file_size:
-            chunk_end = min(file_size, chunk_start + chunk_size)
-            # print("Tentative chunk end: {}".format(chunk_end))
+            # A line longer than the chunk size makes the chunk longer
+            newline = mm.find(b"\n", min(file_size, chunk_start + chunk_size) - 1)
+            chunk_end = file_size if newline == -1 else newline + 1
+            boundaries.append((chunk_start, chunk_end))
+            chunk_start = chunk_end
+    return boundaries
 
-            # Make sure the chunk ends at the beginning of the next line
-            while not is_start_of_line(chunk_end):
-                chunk_end -= 1
 
-            # Handle the case when a line is too long to fit the chunk size
-            if chunk_start == chunk_end:
-                chunk_end = get_next_line_position(chunk_end)
+# Each worker process keeps its own word cache across the chunks it processes
+word_cache: Optional[WordCache] = None
 
-            # Save `process_chunk` arguments
-            args = (file_name, fields, chunk_start, chunk_end)
-            print("Identified chunk {}-{}".format(chunk_start, chunk_end))
-            chunk_args.append(args)
 
-            # Move to the next chunk
-            chunk_start = chunk_end
+def get_word_cache(max_size: int, path: Optional[str]) -> Optional[WordCache]:
+    global word_cache
+    if max_size <= 0:
+        return None
+    if word_cache is None:
+        word_cache = load_word_cache(path, max_size)
+    return word_cache
 
-    with mp.Pool(len(chunk_args)) as p:
-        # Run chunks in parallel
-        chunk_results = p.starmap(process_chunk, chunk_args)
 
-    result = Freqs()
-    # Combine chunk results into `results`
-    for chunk_result in chunk_results:
-        result = union_freqs(result, chunk_result)
-    return result
+# Words cached with their toned syllables when counting tones, syllables or
+# characters, unlike the word cache these are never saved
+syllable_cache: Optional[WordCache] = None
+
+
+def get_syllable_cache(max_size: int) -> Optional[WordCache]:
+    global syllable_cache
+    if max_size <= 0:
+        return None
+    if syllable_cache is None:
+        syllable_cache = WordCache(max_size)
+    return syllable_cache
+
+
+# Hand out the items of `iterable` only while a slot is free,
+# the consumer releases a slot for every item it is done with
+def throttle(iterable, slots: threading.BoundedSemaphore):
+    for item in iterable:
+        slots.acquire()
+        yield item
+
+
+# Tasks are (chunk index, arguments) so that the results can be told apart
+def process_chunk_task(task) -> tuple[int, ChunkResult]:
+    (chunk_index, args) = task
+    return (chunk_index, process_chunk(*args))
+
+
+def process_text_task(task) -> tuple[int, ChunkResult]:
+    (chunk_index, args) = task
+    return (chunk_index, process_text(*args))
 
 
 # Source: https://nurdabolatov.com/parallel-processing-large-file-in-python
-def process_chunk(file_name, fields, chunk_start, chunk_end):
-    print("Processing chunk {}-{}".format(chunk_start, chunk_end))
-    chunk_result = Freqs()
-    with open(file_name, "r") as f:
-        # Moving stream position to `chunk_start`
-        f.seek(chunk_start)
-
-        # Read and process lines until `chunk_end`
-        for line in f:
-            chunk_start += utf8len(line)
-            if chunk_start > chunk_end:
-                break
-            chunk_result = union_freqs(chunk_result, process_line(line, fields))
+def process_chunk(file_name, fields, chunk_start, chunk_end, options: CountOptions):
+    start = time.perf_counter()
+    # Chunks end at line boundaries (or block boundaries of compressed files),
+    # so the lines are whole and decoded by the JSON parser
+    data = read_data(file_name, chunk_start, chunk_end)
+    read_seconds = time.perf_counter() - start
+    chunk_result = process_text(fields, data, options)
+    chunk_result.stats.seconds["read"] += read_seconds
+    chunk_result.stats.busy_seconds += read_seconds
+    return chunk_result
+
+
+# `text` is a string or the UTF-8 bytes of the lines
+def process_text(fields, text: Union[str, bytes], options: CountOptions) -> ChunkResult:
+    chunk_start = time.perf_counter()
+    # Already done by init_worker unless the chunk is processed on its own
+    chunk_segmenter = use_segmenter(options.segmenter, options.dictionary_path)
+    chunk_result = ChunkResult(get_empty_counts(options))
+    text_counts = chunk_result.freqs.text_counts
+    if not chunk_segmenter.segments_words:
+        cache = None
+    elif text_counts is not None:
+        cache = get_syllable_cache(options.word_cache_size)
+    else:
+        cache = get_word_cache(options.word_cache_size, options.word_cache_path)
+    (hits, misses) = (cache.hits, cache.misses) if cache is not None else (0, 0)
+    if cache is not None:
+        cache.take_added()
+    take_unknown_syllables()
+    stats = chunk_result.stats
+    start = time.perf_counter()
+    texts = decode_texts(get_record_lines(text), fields)
+    start = lap(stats, "decode", start)
+    if chunk_segmenter.segments_words:
+        # Segment all lines of the chunk in batches before converting them
+        line_words = list(
+            chunk_segmenter.segment_texts(texts, options.segment_batch_size)
+        )
+        lap(stats, "segmentation", start)
+    else:
+        # pypinyin segments the whole text of every line itself
+        line_words = texts
+    line_components = []
+    for (line_text, words) in zip(texts, line_words):
+        if text_counts is not None:
+            line_components.append(
+                count_line_text(line_text, words, text_counts, cache, stats)
+            )
+        else:
+            line_components.append(get_words_components(words, cache, stats))
+        stats.lines += 1
+    start = time.perf_counter()
+    count_component_lines(line_components, chunk_result.freqs)
+    lap(stats, "counting", start)
+    stats.bytes += len(text) if isinstance(text, bytes) else len(text.encode("utf-8"))
+    if cache is not None:
+        chunk_result.word_cache_hits = cache.hits - hits
+        chunk_result.word_cache_misses = cache.misses - misses
+        # Only words cached with their components are saved
+        if options.word_cache_path is not None and text_counts is None:
+            chunk_result.word_cache_entries = cache.take_added()
+    chunk_result.unknown_syllables = take_unknown_syllables()
+    stats.busy_seconds += time.perf_counter() - chunk_start
     return chunk_result
 
 
-# Source: https://stackoverflow.com/a/30686735/6798201
-def utf8len(s):
-    return len(s.encode("utf-8"))
+# Count a uniform random sample of the lines of a file in batches that double
+# the sample each time, until the confidence intervals of all single and pair
+# frequencies are narrower than the tolerance or the whole file has been counted.
+# Returns the counts of the sample and its confidence intervals.
+def sample_count(
+    file_name,
+    fields,
+    options: Optional[CountOptions] = None,
+    sample_options: Optional[SampleOptions] = None,
+) -> tuple[ArrayFreqs, dict]:
+    options = CountOptions() if options is None else options
+    sample_options = SampleOptions() if sample_options is None else sample_options
+    workers = options.workers if options.workers is not None else mp.cpu_count()
+    (line_starts, line_ends) = get_line_ranges(file_name)
+    population_lines = len(line_starts)
+    print("Sampling from {} lines".format(population_lines))
+    order = np.random.default_rng(sample_options.seed).permutation(population_lines)
+
+    stats = SampleStats()
+    batch_start = 0
+    batch_end = min(population_lines, sample_options.initial_lines)
+    with mp.Pool(workers, initializer=init_worker, initargs=(options,)) as p:
+        while batch_start < batch_end:
+            batch = order[batch_start:batch_end]
+            # A few tasks per worker, reading the lines in file order
+            lines_per_task = -(-len(batch) // (4 * workers))
+            tasks = [
+                (
+                    file_name,
+                    fields,
+                    line_starts[np.sort(batch[i : i + lines_per_task])],
+                    line_ends[np.sort(batch[i : i + lines_per_task])],
+                    options,
+                )
+                for i in range(0, len(batch), lines_per_task)
+            ]
+            for task_stats in p.imap_unordered(process_sample_lines_task, tasks):
+                add_sample_stats(stats, task_stats)
+            single_half_width = np.max(
+                estimate_single_percentages(
+                    stats, population_lines, sample_options.confidence
+                )[1]
+            )
+            pair_half_width = np.max(
+                estimate_pair_percentages(
+                    stats, population_lines, sample_options.confidence
+                )[1]
+            )
+            print(
+                "Sampled {} lines, largest {:.0%} confidence interval: ±{:.4f} (single), ±{:.4f} (pair) percentage points".format(
+                    batch_end,
+                    sample_options.confidence,
+                    single_half_width,
+                    pair_half_width,
+                )
+            )
+            if max(single_half_width, pair_half_width) < sample_options.tolerance:
+                break
+            (batch_start, batch_end) = (batch_end, min(population_lines, 2 * batch_end))
+    if batch_end == population_lines:
+        print("Counted every line before reaching the tolerance")
+    return (
+        stats.freqs,
+        get_confidence_intervals(stats, population_lines, sample_options.confidence),
+    )
+
+
+def process_sample_lines_task(args) -> SampleStats:
+    return process_sample_lines(*args)
+
+
+def process_sample_lines(
+    file_name,
+    fields,
+    line_starts: np.ndarray,
+    line_ends: np.ndarray,
+    options: CountOptions,
+) -> SampleStats:
+    sample_segmenter = use_segmenter(options.segmenter, options.dictionary_path)
+    cache = (
+        get_word_cache(options.word_cache_size, options.word_cache_path)
+        if sample_segmenter.segments_words
+        else None
+    )
+    stats = SampleStats()
+    lines = []
+    with open(file_name, "rb") as f, mmap.mmap(
+        f.fileno(), 0, access=mmap.ACCESS_READ
+    ) as mm:
+        for (line_start, line_end) in zip(line_starts, line_ends):
+            line = mm[line_start:line_end].decode("utf-8")
+            # Blank lines are part of the population but have nothing to count
+            if not line.strip():
+                lines.append([])
+                continue
+            lines.append(get_components(line, fields, cache))
+    count_sample_lines(lines, stats)
+    return stats
 
 
 def union_freqs(freq1: Freqs, freq2: Freqs):
@@ -169,6 +826,31 @@ def union_add(dict1: dict, dict2: dict):
     return {x: dict1.get(x, 0) + dict2.get(x, 0) for x in set(dict1).union(dict2)}
 
 
+def get_output_dir(source_type: str) -> str:
+    return "../results/{}/frequencies".format(source_type)
+
+
+# Sum the raw counts of several runs, eg. of shards of a corpus counted on different nodes
+def merge_counts(file_names: list[str]) -> ArrayFreqs:
+    result = ArrayFreqs()
+    for file_name in file_names:
+        add_array_freqs(result, load_array_freqs(file_name))
+    return result
+
+
+def serialize_counts(source_type: str, counts: ArrayFreqs):
+    output_dir = get_output_dir(source_type)
+    os.makedirs(output_dir, exist_ok=True)
+    save_array_freqs("{}/counts.npz".format(output_dir), counts)
+
+
+def serialize_confidence_intervals(source_type: str, confidence_intervals: dict):
+    output_dir = get_output_dir(source_type)
+    os.makedirs(output_dir, exist_ok=True)
+    with open("{}/confidence_intervals.json".format(output_dir), "w+") as outfile:
+        json.dump(confidence_intervals, outfile)
+
+
 def serialize_freqs(source_type: str, freqs: Freqs):
     serialize_single_freqs(source_type, freqs.single_freqs)
     serialize_pair_freqs(source_type, freqs.pair_freqs)
@@ -183,7 +865,7 @@ def serialize_single_freqs(source_type: str, freqs: SingleFreqs):
             print(key + "\t" + "{:.0f}".format(percent))
             outputs[key] = percent
     print()
-    output_dir = "../results/{}/frequencies".format(source_type)
+    output_dir = get_output_dir(source_type)
     os.makedirs(output_dir, exist_ok=True)
     with open("{}/single_freqs.json".format(output_dir), "w+") as outfile:
         json.dump(outputs, outfile)
@@ -201,29 +883,301 @@ def serialize_pair_freqs(source_type: str, freqs: PairFreqs):
             )
             outputs[key[0] + "+" + key[1]] = percent
     print()
-    output_dir = "../results/{}/frequencies".format(source_type)
+    output_dir = get_output_dir(source_type)
     os.makedirs(output_dir, exist_ok=True)
     with open("{}/pair_freqs.json".format(output_dir), "w+") as outfile:
         json.dump(outputs, outfile)
 
 
+def serialize_text_freqs(source_type: str, counts: ArrayFreqs):
+    text_counts = counts.text_counts
+    if text_counts is None:
+        return
+    outputs = dict()
+    if text_counts.tones:
+        outputs["toned_single_freqs"] = get_percentages(text_counts.toned_single_counts)
+        outputs["toned_pair_freqs"] = {
+            i + "+" + j: percent
+            for (i, j), percent in get_percentages(
+                text_counts.toned_pair_counts
+            ).items()
+        }
+    if text_counts.characters:
+        outputs["syllable_freqs"] = get_percentages(text_counts.syllable_counts)
+        outputs["character_freqs"] = get_percentages(text_counts.character_counts)
+    output_dir = get_output_dir(source_type)
+    os.makedirs(output_dir, exist_ok=True)
+    for name, percentages in outputs.items():
+        with open("{}/{}.json".format(output_dir, name), "w+") as outfile:
+            json.dump(percentages, outfile, ensure_ascii=False)
+    print(
+        "Saved {} to {}".format(
+            ", ".join("{}.json".format(name) for name in outputs), output_dir
+        )
+    )
+
+
+def serialize_pipeline_stats(source_type: str, stats: PipelineStats):
+    report = get_stats_report(stats)
+    print_stats_report(report)
+    save_stats_report(
+        report, "{}/pipeline_stats.json".format(get_output_dir(source_type))
+    )
+
+
+def serialize_ngram_freqs(source_type: str, counts: ArrayFreqs):
+    ngrams = counts.ngram_counts
+    if ngrams is None or ngrams.total == 0:
+        return
+    outputs = dict()
+    for (key, count) in sorted(
+        get_ngram_counts(counts).items(), key=lambda x: x[1], reverse=True
+    ):
+        percent = count / ngrams.total * 100
+        if percent > 0.0001:
+            outputs["+".join(key)] = percent
+    if ngrams.sketch is not None:
+        (error_share, probability) = get_sketch_error(ngrams.sketch)
+        print(
+            "Kept the {} most frequent {}-grams of {}, with probability {:.4f} counts are at most {:.6f}% too high".format(
+                len(ngrams.counts),
+                ngrams.n,
+                ngrams.total,
+                probability,
+                error_share * 100,
+            )
+        )
+        # Anything below the cutoff of the JSON files is dropped anyway
+        if error_share * 100 > 0.0001:
+            print(
+                "The error exceeds the 0.0001% cutoff of the frequencies, use a sketch width of at least {}".format(
+                    get_sketch_width(0.0001 / 100)
+                )
+            )
+    else:
+        # Pruning the least frequent n-grams undercounts any n-gram by at most this much
+        error_percent = ngrams.error_bound / ngrams.total * 100
+        print(
+            "Kept {} distinct {}-grams of {}, counts are at most {:.6f}% too low".format(
+                len(ngrams.counts), ngrams.n, ngrams.total, error_percent
+            )
+        )
+    output_dir = get_output_dir(source_type)
+    os.makedirs(output_dir, exist_ok=True)
+    with open("{}/ngram_freqs.json".format(output_dir), "w+") as outfile:
+        json.dump(outputs, outfile)
+
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(
         description="Compute the frequencies of Pinyin initials and finals."
     )
-    parser.add_argument(
-        "source_type",
-        type=str,
-        help='Type of source to process. Can be one of "news", "zhihu", or "baike".',
+    subparsers = parser.add_subparsers(
+        dest="command",
+        required=True,
+        metavar="command",
+        help='Type of source to process, one of "news", "zhihu", or "baike", or "merge" to sum the raw counts of previous runs.',
     )
-    parser.add_argument(
+    # Options of the source types
+    count_parser = argparse.ArgumentParser(add_help=False)
+    count_parser.add_argument(
         "-s",
         "--set",
         type=str,
         help='Which set of source to use. For news, can be one of "valid_small" (the first 17367 lines of "valid"), "valid" or "train", defaults to "valid_small". For zhihu, can be one of "small", "testa", "valid", or "train", defaults to "testa". For baike, can be one of "valid" or "train", defaults to "valid".',
     )
+    count_parser.add_argument(
+        "-f",
+        "--file",
+        type=str,
+        help="Path of the JSON lines file to process instead of the one of the set, can be compressed ({}).".format(
+            ", ".join(compression_extensions)
+        ),
+    )
+    count_parser.add_argument(
+        "--segmenter",
+        type=str,
+        choices=segmenter_names,
+        default="pkuseg",
+        help='Word segmenter to use. "pkuseg" uses spaCy with the pkuseg "mixed" model, "maxmatch" matches the longest words of a dictionary and "character" leaves the segmentation to pypinyin\'s phrase dictionary. Defaults to "pkuseg".',
+    )
+    count_parser.add_argument(
+        "--dictionary",
+        type=str,
+        help='Word list for the "maxmatch" segmenter with one word per line, defaults to the phrases known to pypinyin.',
+    )
+    count_parser.add_argument(
+        "--word-cache-size",
+        type=int,
+        default=default_word_cache_size,
+        help="Number of segmented words whose Pinyin each worker caches, 0 disables the cache, defaults to {}.".format(
+            default_word_cache_size
+        ),
+    )
+    count_parser.add_argument(
+        "--word-cache",
+        type=str,
+        help="JSON file to warm the word cache from and to save it to after the run.",
+    )
+    count_parser.add_argument(
+        "-w",
+        "--workers",
+        type=int,
+        help="Number of worker processes, defaults to the CPU count.",
+    )
+    count_parser.add_argument(
+        "--chunk-size",
+        type=int,
+        default=default_chunk_size,
+        help="Size in bytes of the chunks of the file the workers take one at a time, defaults to {}.".format(
+            default_chunk_size
+        ),
+    )
+    count_parser.add_argument(
+        "--checkpoint",
+        type=str,
+        help="Directory to save the counts of every chunk to as soon as it is processed.",
+    )
+    count_parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="Resume the run saved in the checkpoint directory, skipping the chunks it already holds.",
+    )
+    count_parser.add_argument(
+        "--part",
+        type=parse_part,
+        help='Only process one part of the chunks, eg. "2/4" for the second of four jobs sharing the checkpoint directory. The frequencies are not saved, a final run with --resume and without --part merges the parts.',
+    )
+    count_parser.add_argument(
+        "--ngrams",
+        type=int,
+        default=0,
+        help="Also count the n-grams of this length (3 for trigrams) of initials and finals, defaults to 0 (none).",
+    )
+    count_parser.add_argument(
+        "--max-ngrams",
+        type=int,
+        default=default_max_ngrams,
+        help="Number of distinct n-grams each worker keeps, dropping the least frequent ones, 0 keeps all. Defaults to {}.".format(
+            default_max_ngrams
+        ),
+    )
+    count_parser.add_argument(
+        "--segment-batch-size",
+        type=int,
+        default=default_segment_batch_size,
+        help="Number of lines handed to the segmenter at once, defaults to {}.".format(
+            default_segment_batch_size
+        ),
+    )
+    count_parser.add_argument(
+        "--tones",
+        action="store_true",
+        help="Also count the initials and tone-annotated finals (eg. ong1, 5 for the neutral tone) and their pairs.",
+    )
+    count_parser.add_argument(
+        "--characters",
+        action="store_true",
+        help="Also count the syllables (with tones when counting tones) and the characters.",
+    )
+    count_parser.add_argument(
+        "--sketch-width",
+        type=int,
+        default=0,
+        help="Count the n-grams of the whole file in a Count-Min sketch of this width and keep the --max-ngrams most frequent ones, so the long tail is counted in fixed memory. Counts are at most e / width of all n-grams too high. Defaults to 0 (exact counts).",
+    )
+    count_parser.add_argument(
+        "--sketch-depth",
+        type=int,
+        default=default_sketch_depth,
+        help="Rows of the Count-Min sketch, the error bound holds with probability 1 - e^-depth. Defaults to {}.".format(
+            default_sketch_depth
+        ),
+    )
+    count_parser.add_argument(
+        "--sample",
+        action="store_true",
+        help="Estimate the frequencies from a random sample of lines that grows until the confidence interval of every frequency is narrower than the tolerance.",
+    )
+    count_parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=SampleOptions.tolerance,
+        help="Largest half-width of the confidence intervals in percentage points when sampling, defaults to {}.".format(
+            SampleOptions.tolerance
+        ),
+    )
+    count_parser.add_argument(
+        "--confidence",
+        type=float,
+        default=SampleOptions.confidence,
+        help="Confidence level of the intervals when sampling, defaults to {}.".format(
+            SampleOptions.confidence
+        ),
+    )
+    count_parser.add_argument(
+        "--sample-lines",
+        type=int,
+        default=SampleOptions.initial_lines,
+        help="Number of lines in the first sample, each further sample doubles it, defaults to {}.".format(
+            SampleOptions.initial_lines
+        ),
+    )
+    count_parser.add_argument(
+        "--seed",
+        type=int,
+        help="Seed of the random sample.",
+    )
+    for source_type in ["news", "zhihu", "baike"]:
+        subparsers.add_parser(
+            source_type,
+            parents=[count_parser],
+            help="Count the {} corpus and save its raw counts and frequencies.".format(
+                source_type
+            ),
+        )
+    merge_parser = subparsers.add_parser(
+        "merge",
+        help="Sum the raw counts of previous runs and save them with their frequencies.",
+    )
+    merge_parser.add_argument(
+        "count_files",
+        type=str,
+        nargs="+",
+        help="Raw counts files (counts.npz) written by previous runs.",
+    )
+    merge_parser.add_argument(
+        "-o",
+        "--output",
+        type=str,
+        required=True,
+        help='Name of the results to write, eg. "zhihu" for ../results/zhihu/frequencies.',
+    )
     args = parser.parse_args()
-    source_type = args.source_type
+    if args.command == "merge":
+        counts = merge_counts(args.count_files)
+        serialize_counts(args.output, counts)
+        serialize_freqs(args.output, get_freqs(counts))
+        serialize_ngram_freqs(args.output, counts)
+        serialize_text_freqs(args.output, counts)
+        sys.exit(0)
+    if (args.resume or args.part is not None) and args.checkpoint is None:
+        parser.error("--resume and --part require --checkpoint")
+    if args.ngrams != 0 and args.ngrams < 3:
+        parser.error("--ngrams counts n-grams of at least 3 symbols")
+    if args.ngrams > get_max_ngram_size(len(symbol_table)):
+        parser.error(
+            "--ngrams counts n-grams of at most {} symbols".format(
+                get_max_ngram_size(len(symbol_table))
+            )
+        )
+    if args.sketch_width != 0 and args.ngrams == 0:
+        parser.error("--sketch-width requires --ngrams")
+    if args.sample and args.checkpoint is not None:
+        parser.error("--sample cannot be checkpointed")
+    if args.sample and (args.tones or args.characters or args.ngrams != 0):
+        parser.error("--sample only estimates the frequencies of initials and finals")
+    source_type = args.command
     source_set = args.set
     if args.set == None:
         if source_type == "news":
@@ -243,10 +1197,59 @@ if __name__ == "__main__":
     elif source_type == "baike":
         file_name = "../data/baike/baike_qa_{}.json".format(source_set)
         fields = ["title", "answer"]
+    # Fall back to a compressed copy of the set if the file itself is missing
+    file_name = args.file if args.file is not None else find_input_file(file_name)
     print(
-        "Processing the {} set of {} with fields {}".format(
-            source_set, source_type, ", ".join(fields)
+        "Processing {} ({} set of {}) with fields {}".format(
+            file_name, source_set, source_type, ", ".join(fields)
         )
     )
-    freqs = measure(parallel_read, file_name, fields)
-    serialize_freqs(source_type, freqs)
+    options = CountOptions(
+        segmenter=args.segmenter,
+        dictionary_path=args.dictionary,
+        word_cache_size=args.word_cache_size,
+        word_cache_path=args.word_cache,
+        workers=args.workers,
+        chunk_size=args.chunk_size,
+        checkpoint_dir=args.checkpoint,
+        resume=args.resume,
+        part=args.part,
+        ngram_size=args.ngrams,
+        max_ngrams=args.max_ngrams if args.max_ngrams > 0 else None,
+        segment_batch_size=args.segment_batch_size,
+        sketch_width=args.sketch_width,
+        sketch_depth=args.sketch_depth,
+        tones=args.tones,
+        characters=args.characters,
+    )
+    if args.sample:
+        if get_compression(file_name) is not None:
+            parser.error(
+                "--sample needs random access to the lines of an uncompressed file"
+            )
+        sample_options = SampleOptions(
+            tolerance=args.tolerance,
+            confidence=args.confidence,
+            initial_lines=args.sample_lines,
+            seed=args.seed,
+        )
+        (counts, confidence_intervals) = measure(
+            sample_count, file_name, fields, options, sample_options
+        )
+        serialize_counts(source_type, counts)
+        serialize_freqs(source_type, get_freqs(counts))
+        serialize_confidence_intervals(source_type, confidence_intervals)
+        sys.exit(0)
+    stats = PipelineStats()
+    try:
+        counts = measure(parallel_count, file_name, fields, options, stats)
+    except CheckpointError as error:
+        parser.error(str(error))
+    if args.part is None:
+        serialize_counts(source_type, counts)
+        serialize_freqs(source_type, get_freqs(counts))
+        serialize_ngram_freqs(source_type, counts)
+        serialize_text_freqs(source_type, counts)
+        serialize_pipeline_stats(source_type, stats)
+    else:
+        print_stats_report(get_stats_report(stats))
@@ -0,0 +1,207 @@
+import argparse
+import gzip
+import io
+import json
+import lzma
+import mmap
+import os
+from typing import Iterator, Optional
+
+# Compressed corpora are read directly. A file written by compress_corpus is a
+# series of independently compressed blocks of whole lines, so the standard
+# tools still decompress it as a whole, and the byte ranges of the blocks are
+# stored next to it so that the blocks can be decompressed in parallel.
+
+compression_extensions: dict[str, str] = {
+    ".gz": "gzip",
+    ".xz": "xz",
+    ".zst": "zstd",
+}
+
+compression_names: list[str] = list(compression_extensions.values())
+
+# Uncompressed size of the blocks written by compress_corpus
+default_block_size = 4 * 1024 * 1024
+
+
+def get_compression(file_name: str) -> Optional[str]:
+    return compression_extensions.get(os.path.splitext(file_name)[1])
+
+
+# The file itself if it exists, else the first compressed version of it that does
+def find_input_file(file_name: str) -> str:
+    if os.path.exists(file_name):
+        return file_name
+    for extension in compression_extensions:
+        if os.path.exists(file_name + extension):
+            return file_name + extension
+    raise FileNotFoundError(
+        "Neither {} nor a compressed version of it ({}) exists".format(
+            file_name, ", ".join(compression_extensions)
+        )
+    )
+
+
+def import_zstandard():
+    try:
+        import zstandard
+    except ImportError:
+        raise ImportError(
+            "Reading and writing zstd files requires the zstandard package (pip install zstandard)"
+        )
+    return zstandard
+
+
+def compress(data: bytes, compression: str) -> bytes:
+    if compression == "gzip":
+        return gzip.compress(data)
+    elif compression == "xz":
+        return lzma.compress(data)
+    elif compression == "zstd":
+        return import_zstandard().ZstdCompressor().compress(data)
+    raise ValueError('Unknown compression "{}"'.format(compression))
+
+
+# Decompress one or more concatenated gzip members, xz streams or zstd frames
+def decompress(data: bytes, compression: Optional[str]) -> bytes:
+    if compression is None:
+        return data
+    elif compression == "gzip":
+        return gzip.decompress(data)
+    elif compression == "xz":
+        return lzma.decompress(data)
+    elif compression == "zstd":
+        zstandard = import_zstandard()
+        reader = zstandard.ZstdDecompressor().stream_reader(
+            io.BytesIO(data), read_across_frames=True
+        )
+        return reader.read()
+    raise ValueError('Unknown compression "{}"'.format(compression))
+
+
+def open_binary(file_name: str):
+    compression = get_compression(file_name)
+    if compression is None:
+        return open(file_name, "rb")
+    elif compression == "gzip":
+        return gzip.open(file_name, "rb")
+    elif compression == "xz":
+        return lzma.open(file_name, "rb")
+    zstandard = import_zstandard()
+    return zstandard.ZstdDecompressor().stream_reader(
+        open(file_name, "rb"), read_across_frames=True, closefd=True
+    )
+
+
+def get_block_index_path(file_name: str) -> str:
+    return file_name + ".blocks.json"
+
+
+# Byte ranges of the independently compressed blocks of a file,
+# or None if the file was not written by compress_corpus
+def load_block_index(file_name: str) -> Optional[list[tuple[int, int]]]:
+    path = get_block_index_path(file_name)
+    if not os.path.exists(path):
+        return None
+    # A block index older than the file belongs to a previous version of it
+    if os.path.getmtime(path) < os.path.getmtime(file_name):
+        return None
+    with open(path, "r") as infile:
+        return [(start, end) for (start, end) in json.load(infile)["blocks"]]
+
+
+# Decoded text of the bytes from `start` to `end`, which have to hold
+# whole lines, or whole compressed blocks for a compressed file
+def read_data(file_name: str, start: int, end: int) -> bytes:
+    with open(file_name, "rb") as f, mmap.mmap(
+        f.fileno(), 0, access=mmap.ACCESS_READ
+    ) as mm:
+        data = mm[start:end]
+    return decompress(data, get_compression(file_name))
+
+
+def read_text(file_name: str, start: int, end: int) -> str:
+    return read_data(file_name, start, end).decode("utf-8")
+
+
+# Decompress a file as a stream and yield its text in pieces of whole lines
+# of about `chunk_size` bytes, for compressed files without a block index
+def iter_text_chunks(file_name: str, chunk_size: int) -> Iterator[str]:
+    with open_binary(file_name) as f:
+        remainder = b""
+        while True:
+            data = f.read(chunk_size)
+            if not data:
+                break
+            data = remainder + data
+            newline = data.rfind(b"\n")
+            if newline == -1:
+                remainder = data
+                continue
+            remainder = data[newline + 1 :]
+            yield data[: newline + 1].decode("utf-8")
+        if remainder:
+            yield remainder.decode("utf-8")
+
+
+# Write `input_name` as independently compressed blocks of whole lines
+# together with the block index that lets parallel_read distribute them
+def compress_corpus(
+    input_name: str, output_name: str, block_size: int = default_block_size
+):
+    compression = get_compression(output_name)
+    if compression is None:
+        raise ValueError(
+            "Cannot tell the compression of {} from its extension, expected one of {}".format(
+                output_name, ", ".join(compression_extensions)
+            )
+        )
+    blocks = []
+    with open_binary(input_name) as infile, open(output_name, "wb") as outfile:
+        remainder = b""
+        while True:
+            data = infile.read(block_size)
+            block = remainder + data
+            if data:
+                newline = block.rfind(b"\n")
+                if newline == -1:
+                    remainder = block
+                    continue
+                (block, remainder) = (block[: newline + 1], block[newline + 1 :])
+            if block:
+                start = outfile.tell()
+                outfile.write(compress(block, compression))
+                blocks.append((start, outfile.tell()))
+            if not data:
+                break
+    with open(get_block_index_path(output_name), "w+") as outfile:
+        json.dump({"compression": compression, "blocks": blocks}, outfile)
+    print("Wrote {} blocks to {}".format(len(blocks), output_name))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Compress a JSON lines corpus into independently compressed blocks that compute_frequencies.py can decompress in parallel."
+    )
+    parser.add_argument(
+        "input_name",
+        type=str,
+        help="Corpus to compress, can itself be compressed.",
+    )
+    parser.add_argument(
+        "output_name",
+        type=str,
+        help="Compressed file to write, the compression is taken from its extension ({}).".format(
+            ", ".join(compression_extensions)
+        ),
+    )
+    parser.add_argument(
+        "--block-size",
+        type=int,
+        default=default_block_size,
+        help="Uncompressed size in bytes of the blocks, defaults to {}.".format(
+            default_block_size
+        ),
+    )
+    args = parser.parse_args()
+    compress_corpus(args.input_name, args.output_name, args.block_size)
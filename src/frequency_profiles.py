@@ -0,0 +1,156 @@
+import argparse
+import json
+import math
+import os
+from dataclasses import dataclass
+from typing import Optional
+from symbols import ArrayFreqs, get_pair_counts, get_single_counts, load_array_freqs
+
+# A frequency profile is what the scorers weigh layouts by: the percentages of the
+# initials and finals and of the pairs of them typed in a row. Profiles come from
+# the JSON files written by compute_frequencies.py, from its raw counts files, or
+# from a weighted blend of several of them for a particular population of users.
+
+
+@dataclass
+class FrequencyProfile:
+    single_freqs: dict[str, float]
+    pair_freqs: dict[tuple[str, str], float]
+
+
+default_profile_dir = "../results/zhihu/frequencies"
+
+# Same cutoff as the JSON files of compute_frequencies.py,
+# it also drops stray components that no key can type
+min_percent = 0.0001
+
+
+def load_json_profile(freqs_dir: str) -> FrequencyProfile:
+    with open(os.path.join(freqs_dir, "single_freqs.json"), "r") as infile:
+        single_freqs = json.load(infile)
+    with open(os.path.join(freqs_dir, "pair_freqs.json"), "r") as infile:
+        pair_freqs = {tuple(k.split("+")): v for k, v in json.load(infile).items()}
+    return FrequencyProfile(single_freqs, pair_freqs)
+
+
+def get_percentages(counts: dict) -> dict:
+    total_count = sum(counts.values())
+    percentages = dict()
+    for (key, count) in sorted(counts.items(), key=lambda x: x[1], reverse=True):
+        percent = count / total_count * 100
+        if percent > min_percent:
+            percentages[key] = percent
+    return percentages
+
+
+def profile_from_counts(counts: ArrayFreqs) -> FrequencyProfile:
+    return FrequencyProfile(
+        get_percentages(get_single_counts(counts)),
+        get_percentages(get_pair_counts(counts)),
+    )
+
+
+# A raw counts file (.npz) or a directory with the JSON files of a run
+def load_profile(path: str) -> FrequencyProfile:
+    if os.path.isdir(path):
+        return load_json_profile(path)
+    return profile_from_counts(load_array_freqs(path))
+
+
+# Weighted average of the percentages of each profile, so that a weight is the share
+# of a population in the blend no matter how large the corpus behind each profile is
+def blend_profiles(
+    profiles: list[FrequencyProfile], weights: list[float]
+) -> FrequencyProfile:
+    total_weight = sum(weights)
+    single_freqs: dict[str, float] = dict()
+    pair_freqs: dict[tuple[str, str], float] = dict()
+    for profile, weight in zip(profiles, weights):
+        for key, percent in profile.single_freqs.items():
+            single_freqs[key] = (
+                single_freqs.get(key, 0) + percent * weight / total_weight
+            )
+        for key, percent in profile.pair_freqs.items():
+            pair_freqs[key] = pair_freqs.get(key, 0) + percent * weight / total_weight
+    return FrequencyProfile(single_freqs, pair_freqs)
+
+
+# "path:weight" or just "path" for a weight of 1.
+# Weights must be positive, they are normalized by their sum.
+def parse_weighted_source(source: str) -> tuple[str, float]:
+    (path, separator, weight_text) = source.rpartition(":")
+    if not separator:
+        return (source, 1.0)
+    try:
+        weight = float(weight_text)
+    except ValueError:
+        weight = math.nan
+    if not (math.isfinite(weight) and weight > 0):
+        raise ValueError(
+            'Expected a finite positive weight for "{}", got "{}"'.format(
+                path, weight_text
+            )
+        )
+    return (path, weight)
+
+
+def parse_weighted_sources(sources: list[str]) -> list[tuple[str, float]]:
+    return [parse_weighted_source(source) for source in sources]
+
+
+def load_blend(weighted_sources: list[tuple[str, float]]) -> FrequencyProfile:
+    if len(weighted_sources) == 1 and weighted_sources[0][1] == 1.0:
+        return load_profile(weighted_sources[0][0])
+    return blend_profiles(
+        [load_profile(path) for (path, _) in weighted_sources],
+        [weight for (_, weight) in weighted_sources],
+    )
+
+
+default_profile: Optional[FrequencyProfile] = None
+
+
+# The Zhihu frequencies, only loaded when a scorer is used without a profile
+def get_default_profile() -> FrequencyProfile:
+    global default_profile
+    if default_profile is None:
+        default_profile = load_json_profile(default_profile_dir)
+    return default_profile
+
+
+def save_json_profile(profile: FrequencyProfile, freqs_dir: str):
+    os.makedirs(freqs_dir, exist_ok=True)
+    with open(os.path.join(freqs_dir, "single_freqs.json"), "w+") as outfile:
+        json.dump(profile.single_freqs, outfile)
+    with open(os.path.join(freqs_dir, "pair_freqs.json"), "w+") as outfile:
+        json.dump(
+            {i + "+" + j: percent for (i, j), percent in profile.pair_freqs.items()},
+            outfile,
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Blend the frequencies of several corpora into one frequency profile."
+    )
+    parser.add_argument(
+        "sources",
+        type=str,
+        nargs="+",
+        help='Raw counts files (counts.npz) or frequency directories with their weights, eg. "../results/zhihu/frequencies/counts.npz:0.7". The weights default to 1 and are normalized.',
+    )
+    parser.add_argument(
+        "-o",
+        "--output",
+        type=str,
+        required=True,
+        help='Name of the profile to write, eg. "blend" for ../results/blend/frequencies.',
+    )
+    args = parser.parse_args()
+    try:
+        weighted_sources = parse_weighted_sources(args.sources)
+    except ValueError as error:
+        parser.error(str(error))
+    output_dir = "../results/{}/frequencies".format(args.output)
+    save_json_profile(load_blend(weighted_sources), output_dir)
+    print("Saved the blended frequencies to {}".format(output_dir))
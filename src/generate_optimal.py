@@ -4,17 +4,38 @@ from shuangpin import (
     get_random_final_layout,
     get_random_variant_to_standard_finals,
     get_random_zero_consonant_final_layout,
-    get_score,
-    qwerty_layout,
     digraph_initials,
     fixed_finals_to_keys,
     finals,
     zero_consonant_finals,
     default_initial_constraints,
 )
+from keyboard import qwerty_layout
+from scoring_engine import (
+    ScoreCache,
+    ScoringEngine,
+    compile_engine,
+    get_default_engine,
+    keys,
+    key_ids,
+    cache_scores,
+    rescore,
+    encode_config_slots,
+    score_slot_key_matrix,
+    combine_score_matrix,
+    get_compiled_score,
+)
 import random
-from dataclasses import dataclass
+import queue
+import argparse
+import multiprocessing as mp
+import multiprocessing.pool
+from multiprocessing import resource_tracker, shared_memory
+import numpy as np
+from dataclasses import dataclass, field
+from typing import Optional
 from utils import random_choice_except_index
+from frequency_profiles import FrequencyProfile, load_blend, parse_weighted_sources
 
 
 @dataclass
@@ -23,6 +44,11 @@ class Chromosome:
     digraph_initial_keys: list[str]
     zero_consonant_final_keys: list[tuple[str, str]]
     variant_to_standard_finals: dict[str, str]
+    # Combined score, known once the chromosome has been scored
+    score: Optional[float] = field(default=None, compare=False)
+    # Scores of the chromosome, filled in when it becomes a parent
+    # or when it is derived from one
+    score_cache: Optional[ScoreCache] = field(default=None, repr=False, compare=False)
 
 
 def final_keys_to_layout(
@@ -136,44 +162,206 @@ def get_random_chromosome():
         )
 
 
+def chromosome_to_config(chromosome: Chromosome) -> ShuangpinConfig:
+    return ShuangpinConfig(
+        final_layout=final_keys_to_layout(
+            chromosome.final_keys, chromosome.variant_to_standard_finals
+        ),
+        digraph_initial_layout=digraph_initial_keys_to_layout(
+            chromosome.digraph_initial_keys
+        ),
+        zero_consonant_final_layout=zero_consonant_final_keys_to_layout(
+            chromosome.zero_consonant_final_keys
+        ),
+        variant_to_standard_finals=chromosome.variant_to_standard_finals,
+    )
+
+
+# Engine compiled from the frequency profile the layouts are optimized for
+engine: Optional[ScoringEngine] = None
+
+
+def use_profile(profile: Optional[FrequencyProfile]):
+    global engine
+    engine = compile_engine(profile) if profile is not None else None
+
+
+def get_engine() -> ScoringEngine:
+    return engine if engine is not None else get_default_engine()
+
+
 def score_chromosome(chromosome: Chromosome) -> float:
-    return get_score(
-        ShuangpinConfig(
-            final_layout=final_keys_to_layout(
-                chromosome.final_keys, chromosome.variant_to_standard_finals
-            ),
-            digraph_initial_layout=digraph_initial_keys_to_layout(
-                chromosome.digraph_initial_keys
-            ),
-            zero_consonant_final_layout=zero_consonant_final_keys_to_layout(
-                chromosome.zero_consonant_final_keys
-            ),
-            variant_to_standard_finals=chromosome.variant_to_standard_finals,
+    return get_compiled_score(chromosome_to_config(chromosome), get_engine())
+
+
+# Encode each chromosome as one row of key ids per symbol slot
+def encode_chromosomes(chromosomes: list[Chromosome]) -> np.ndarray:
+    return np.array(
+        [
+            encode_config_slots(get_engine(), chromosome_to_config(chromosome))
+            for chromosome in chromosomes
+        ],
+        dtype=np.intp,
+    ).reshape(len(chromosomes), 2 * len(get_engine().symbols))
+
+
+# Score a whole pool in one vectorized pass over all five metrics
+# Chromosomes that already have a score are not scored again
+def score_population(chromosomes: list[Chromosome]) -> np.ndarray:
+    unscored = [chromosome for chromosome in chromosomes if chromosome.score is None]
+    unscored_scores = combine_score_matrix(
+        score_slot_key_matrix(get_engine(), encode_chromosomes(unscored))
+    )
+    for chromosome, score in zip(unscored, unscored_scores):
+        chromosome.score = float(score)
+    return np.array([chromosome.score for chromosome in chromosomes])
+
+
+def get_score_cache(chromosome: Chromosome) -> ScoreCache:
+    if chromosome.score_cache is None:
+        chromosome.score_cache = cache_scores(
+            get_engine(), encode_chromosomes([chromosome])[0]
         )
+        chromosome.score = chromosome.score_cache.score
+    return chromosome.score_cache
+
+
+# Score a child by updating the cached scores of the parent it was derived from
+# with only the slots whose keys differ between the two
+def rescore_child(parent: Chromosome, child: Chromosome):
+    parent_cache = get_score_cache(parent)
+    child_slot_keys = encode_chromosomes([child])[0]
+    changed_slots = np.flatnonzero(child_slot_keys != parent_cache.slot_keys)
+    child.score_cache = rescore(
+        get_engine(),
+        parent_cache,
+        {slot: child_slot_keys[slot] for slot in changed_slots},
+    )
+    child.score = child.score_cache.score
+
+
+# Chromosomes cross process boundaries packed as one row of small integers:
+# the number of variant finals, the (variant, standard) final ids,
+# then the key ids of the finals, digraph initials and zero-consonant finals.
+# Scores travel separately and score caches stay in the process that built them.
+final_ids: dict[str, int] = {final: i for i, final in enumerate(finals)}
+
+
+def pack_chromosome(chromosome: Chromosome) -> list[int]:
+    row = [len(chromosome.variant_to_standard_finals)]
+    for variant, standard in chromosome.variant_to_standard_finals.items():
+        row += [final_ids[variant], final_ids[standard]]
+    row += [key_ids[key] for key in chromosome.final_keys]
+    row += [key_ids[key] for key in chromosome.digraph_initial_keys]
+    for (first_key, second_key) in chromosome.zero_consonant_final_keys:
+        row += [key_ids[first_key], key_ids[second_key]]
+    return row
+
+
+def unpack_chromosome(row: list[int]) -> Chromosome:
+    num_variants = row[0]
+    variant_end = 1 + 2 * num_variants
+    final_end = variant_end + len(finals) - num_variants
+    digraph_end = final_end + len(digraph_initials)
+    return Chromosome(
+        final_keys=[keys[i] for i in row[variant_end:final_end]],
+        digraph_initial_keys=[keys[i] for i in row[final_end:digraph_end]],
+        zero_consonant_final_keys=[
+            (keys[row[i]], keys[row[i + 1]]) for i in range(digraph_end, len(row), 2)
+        ],
+        variant_to_standard_finals={
+            finals[row[i]]: finals[row[i + 1]] for i in range(1, variant_end, 2)
+        },
+    )
+
+
+def pack_chromosomes(chromosomes: list[Chromosome]) -> np.ndarray:
+    return np.array(
+        [pack_chromosome(chromosome) for chromosome in chromosomes], dtype=np.int8
     )
 
 
+def unpack_chromosomes(packed: np.ndarray) -> list[Chromosome]:
+    return [unpack_chromosome(row) for row in packed.tolist()]
+
+
 # must be divisible by 2
 initial_pool_size = 8000
 
+# Work handed to each task when a process pool is used
+chromosomes_per_task = 500
+receivers_per_task = 50
+
+
+def get_task_seeds(num_tasks: int) -> list[int]:
+    # Forked workers start from the same random state,
+    # so every task draws its own seed from the main process
+    return [random.getrandbits(64) for _ in range(num_tasks)]
+
 
 # Generate 2,000 random candidate chromosomes
-def initialization():
-    return [get_random_chromosome() for _ in range(initial_pool_size)]
+def initialization(process_pool: Optional[mp.pool.Pool] = None):
+    return get_random_chromosomes(initial_pool_size, process_pool)
+
+
+def get_random_chromosomes(
+    count: int, process_pool: Optional[mp.pool.Pool] = None
+) -> list[Chromosome]:
+    if process_pool is None:
+        return [get_random_chromosome() for _ in range(count)]
+    counts = [
+        min(chromosomes_per_task, count - start)
+        for start in range(0, count, chromosomes_per_task)
+    ]
+    packed_chunks = process_pool.starmap(
+        get_packed_random_chromosomes, zip(counts, get_task_seeds(len(counts)))
+    )
+    return [
+        chromosome
+        for packed in packed_chunks
+        for chromosome in unpack_chromosomes(packed)
+    ]
+
+
+def get_packed_random_chromosomes(count: int, seed: int) -> np.ndarray:
+    random.seed(seed)
+    return pack_chromosomes([get_random_chromosome() for _ in range(count)])
+
+
+def score_packed_chromosomes(packed: np.ndarray) -> np.ndarray:
+    return score_population(unpack_chromosomes(packed))
 
 
 # Evaluate each candidate layout and sort them in ascending order
 # from lower score (more optimal chromosome) to higher score (less optimal chromosome)
-def evaluation(pool: list[Chromosome]):
-    return sorted(pool, key=lambda chromosome: score_chromosome(chromosome))
+def evaluation(pool: list[Chromosome], process_pool: Optional[mp.pool.Pool] = None):
+    if process_pool is not None:
+        unscored = [chromosome for chromosome in pool if chromosome.score is None]
+        packed = pack_chromosomes(unscored)
+        chunks = [
+            packed[start : start + chromosomes_per_task]
+            for start in range(0, len(packed), chromosomes_per_task)
+        ]
+        for chromosome, score in zip(
+            unscored,
+            (
+                score
+                for chunk_scores in process_pool.map(score_packed_chromosomes, chunks)
+                for score in chunk_scores
+            ),
+        ):
+            chromosome.score = float(score)
+    scores = score_population(pool)
+    # A stable sort keeps the order of equally scored chromosomes like sorted() does
+    return [pool[i] for i in np.argsort(scores, kind="stable")]
 
 
 # Select the 1,000 best chromosomes from the sorted chromosome pool
 # and add 1,000 new random chromosomes to the pool
-def selection(pool: list[Chromosome]):
-    return pool[: initial_pool_size // 2] + [
-        get_random_chromosome() for _ in range(initial_pool_size // 2)
-    ]
+def selection(pool: list[Chromosome], process_pool: Optional[mp.pool.Pool] = None):
+    return pool[: initial_pool_size // 2] + get_random_chromosomes(
+        initial_pool_size // 2, process_pool
+    )
 
 
 def get_key_by_value(dictionary: dict, value):
@@ -279,27 +467,322 @@ def crossover(
     )
 
 
-def reproduction(pool: list[Chromosome]) -> list[Chromosome]:
-    parents = pool[: initial_pool_size // 2]
-    for i, receiver in enumerate(parents):
+def reproduce(parents: list[Chromosome], receiver_indices: range) -> list[Chromosome]:
+    children = []
+    for i in receiver_indices:
+        receiver = parents[i]
         for _ in range(10):
             donor = random_choice_except_index(parents, i)
             child = crossover(receiver, donor, default_initial_constraints)
-            pool.append(child)
+            rescore_child(receiver, child)
+            children.append(child)
+    return children
+
+
+# Parents of the generation a worker is reproducing, unpacked once per generation
+# and kept by the name of the shared memory block they were read from
+worker_parents: Optional[tuple[str, list[Chromosome]]] = None
+
+
+def get_shared_parents(name: str, shape: tuple[int, int]) -> list[Chromosome]:
+    global worker_parents
+    if worker_parents is None or worker_parents[0] != name:
+        block = shared_memory.SharedMemory(name=name)
+        try:
+            worker_parents = (
+                name,
+                unpack_chromosomes(np.ndarray(shape, dtype=np.int8, buffer=block.buf)),
+            )
+        finally:
+            block.close()
+    return worker_parents[1]
+
+
+def reproduce_packed(
+    parents_name: str,
+    parents_shape: tuple[int, int],
+    receiver_indices: range,
+    seed: int,
+) -> tuple[np.ndarray, np.ndarray]:
+    random.seed(seed)
+    children = reproduce(
+        get_shared_parents(parents_name, parents_shape), receiver_indices
+    )
+    return (
+        pack_chromosomes(children),
+        np.array([child.score for child in children]),
+    )
+
+
+def reproduction(
+    pool: list[Chromosome], process_pool: Optional[mp.pool.Pool] = None
+) -> list[Chromosome]:
+    parents = pool[: initial_pool_size // 2]
+    if process_pool is None:
+        pool += reproduce(parents, range(len(parents)))
+        return pool
+    # Every task picks donors from all parents, so the parents are put in shared
+    # memory once per generation instead of being pickled to every task
+    packed_parents = pack_chromosomes(parents)
+    block = shared_memory.SharedMemory(create=True, size=packed_parents.nbytes)
+    try:
+        np.copyto(
+            np.ndarray(packed_parents.shape, dtype=np.int8, buffer=block.buf),
+            packed_parents,
+        )
+        receiver_ranges = [
+            range(start, min(start + receivers_per_task, len(parents)))
+            for start in range(0, len(parents), receivers_per_task)
+        ]
+        for packed_children, scores in process_pool.starmap(
+            reproduce_packed,
+            (
+                (block.name, packed_parents.shape, receiver_indices, seed)
+                for receiver_indices, seed in zip(
+                    receiver_ranges, get_task_seeds(len(receiver_ranges))
+                )
+            ),
+        ):
+            for child, score in zip(unpack_chromosomes(packed_children), scores):
+                child.score = float(score)
+                pool.append(child)
+    finally:
+        block.close()
+        block.unlink()
     # print("len(pool): ", len(pool))
     return pool
 
 
-def genetic_algorithm():
-    pool = initialization()
-    for i in range(100):
+def run_generations(
+    generations: int = 100, process_pool: Optional[mp.pool.Pool] = None
+):
+    pool = initialization(process_pool)
+    for i in range(generations):
         print(i, score_chromosome(pool[0]))
         print_chromosome(pool[0])
 
-        pool = evaluation(pool)
-        pool = selection(pool)
-        pool = reproduction(pool)
+        pool = evaluation(pool, process_pool)
+        pool = selection(pool, process_pool)
+        pool = reproduction(pool, process_pool)
     return pool[0]
 
 
-genetic_algorithm()
+def genetic_algorithm(
+    generations: int = 100,
+    workers: int = 1,
+    profile: Optional[FrequencyProfile] = None,
+):
+    use_profile(profile)
+    if workers <= 1:
+        return run_generations(generations)
+    # Forked workers share the resource tracker of this process if it already
+    # runs, otherwise each starts its own that reports the shared parents as leaked
+    resource_tracker.ensure_running()
+    # Each worker compiles the scoring engine of the profile once
+    # when it starts, only packed chromosomes are sent to it
+    with mp.Pool(workers, initializer=use_profile, initargs=(profile,)) as process_pool:
+        return run_generations(generations, process_pool)
+
+
+def receive_migrants(inbox: mp.Queue) -> list[Chromosome]:
+    # Take whatever has arrived without waiting for the neighboring island
+    migrants = []
+    while True:
+        try:
+            migrants += unpack_chromosomes(inbox.get_nowait())
+        except queue.Empty:
+            return migrants
+
+
+# Evolve one island and send its best chromosomes to the next island
+# every migration_interval generations
+def run_island(
+    island: int,
+    pool_size: int,
+    generations: int,
+    migration_interval: int,
+    num_migrants: int,
+    inbox: mp.Queue,
+    outbox: mp.Queue,
+    results: mp.Queue,
+    seed: int,
+    profile: Optional[FrequencyProfile] = None,
+):
+    global initial_pool_size
+    initial_pool_size = pool_size
+    use_profile(profile)
+    random.seed(seed)
+    # Migrants still buffered when the next island has finished are dropped
+    # instead of keeping this process alive
+    outbox.cancel_join_thread()
+
+    pool = initialization()
+    for i in range(generations):
+        # Migrants compete with the island's own chromosomes in evaluation
+        # and only the fit ones survive selection
+        pool += receive_migrants(inbox)
+        pool = evaluation(pool)
+        print(
+            "island {} generation {}: {}".format(island, i, pool[0].score), flush=True
+        )
+        if (i + 1) % migration_interval == 0:
+            outbox.put(pack_chromosomes(pool[:num_migrants]))
+        pool = selection(pool)
+        pool = reproduction(pool)
+    pool = evaluation(pool)
+    results.put((island, pack_chromosomes(pool[:1]), pool[0].score))
+
+
+# Island model: independent pools evolve in separate processes and
+# periodically pass their best chromosomes around a ring of islands.
+# Islands never wait for each other, so the model scales with the number of cores.
+def island_model(
+    num_islands: int,
+    generations: int = 100,
+    migration_interval: int = 10,
+    num_migrants: int = 20,
+    profile: Optional[FrequencyProfile] = None,
+) -> Chromosome:
+    inboxes = [mp.Queue() for _ in range(num_islands)]
+    results: mp.Queue = mp.Queue()
+    islands = [
+        mp.Process(
+            target=run_island,
+            args=(
+                island,
+                initial_pool_size,
+                generations,
+                migration_interval,
+                num_migrants,
+                inboxes[island],
+                inboxes[(island + 1) % num_islands],
+                results,
+                seed,
+                profile,
+            ),
+        )
+        for island, seed in enumerate(get_task_seeds(num_islands))
+    ]
+    for process in islands:
+        process.start()
+    island_results = []
+    while len(island_results) < num_islands:
+        try:
+            island_results.append(results.get(timeout=1))
+        except queue.Empty:
+            # An island that died (eg. from an exception or running out of
+            # memory) never sends its result, so stop instead of waiting forever
+            failed = [
+                (island, process.exitcode)
+                for island, process in enumerate(islands)
+                if process.exitcode not in (None, 0)
+            ]
+            if failed:
+                for process in islands:
+                    process.terminate()
+                raise RuntimeError(
+                    "Islands exited without a result: {}".format(
+                        ", ".join(
+                            "{} (exit code {})".format(island, exitcode)
+                            for island, exitcode in failed
+                        )
+                    )
+                )
+    # Only join once the results are drained, a process does not exit
+    # before the data it put on a queue has been read
+    for process in islands:
+        process.join()
+
+    island, packed_best, score = min(island_results, key=lambda result: result[2])
+    best = unpack_chromosomes(packed_best)[0]
+    best.score = score
+    print("Best chromosome from island {}: {}".format(island, score))
+    print_chromosome(best)
+    return best
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Search for an optimal Shuangpin layout with a genetic algorithm."
+    )
+    parser.add_argument(
+        "-g",
+        "--generations",
+        type=int,
+        default=100,
+        help="Number of generations to evolve, defaults to 100.",
+    )
+    parser.add_argument(
+        "-p",
+        "--pool-size",
+        type=int,
+        default=initial_pool_size,
+        help="Number of chromosomes in the pool (per island when using islands), must be divisible by 2, defaults to {}.".format(
+            initial_pool_size
+        ),
+    )
+    parser.add_argument(
+        "-w",
+        "--workers",
+        type=int,
+        default=1,
+        help="Number of worker processes used to generate, score and reproduce chromosomes, defaults to 1 (no process pool).",
+    )
+    parser.add_argument(
+        "-i",
+        "--islands",
+        type=int,
+        default=0,
+        help="Number of islands evolving independently in their own processes, defaults to 0 (a single pool).",
+    )
+    parser.add_argument(
+        "--migration-interval",
+        type=int,
+        default=10,
+        help="Number of generations between migrations between islands, defaults to 10.",
+    )
+    parser.add_argument(
+        "--migrants",
+        type=int,
+        default=20,
+        help="Number of best chromosomes an island sends to the next island in each migration, defaults to 20.",
+    )
+    parser.add_argument(
+        "--profile",
+        type=str,
+        nargs="+",
+        help='Frequencies to optimize for, raw counts files (counts.npz) or frequency directories with optional weights to blend them, eg. "../results/zhihu/frequencies:0.7 ../results/news/frequencies/counts.npz:0.3". Defaults to the Zhihu frequencies.',
+    )
+    args = parser.parse_args()
+    if args.pool_size % 2 != 0:
+        parser.error("the pool size must be divisible by 2")
+    if args.migration_interval <= 0:
+        parser.error("the migration interval must be at least 1")
+    if not 0 <= args.migrants <= args.pool_size:
+        parser.error(
+            "the number of migrants must be between 0 and the pool size ({})".format(
+                args.pool_size
+            )
+        )
+    if args.islands > 0 and args.workers > 1:
+        parser.error(
+            "islands already run in their own processes, use either --islands or --workers"
+        )
+    profile = None
+    if args.profile is not None:
+        try:
+            weighted_sources = parse_weighted_sources(args.profile)
+        except ValueError as error:
+            parser.error(str(error))
+        profile = load_blend(weighted_sources)
+    initial_pool_size = args.pool_size
+    if args.islands > 0:
+        island_model(
+            args.islands,
+            args.generations,
+            args.migration_interval,
+            args.migrants,
+            profile,
+        )
+    else:
+        genetic_algorithm(args.generations, args.workers, profile)
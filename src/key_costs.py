@@ -0,0 +1,67 @@
+import numpy as np
+from keyboard import (
+    qwerty_layout,
+    is_same_hand,
+    is_same_finger,
+    distance,
+    get_big_step_penalty,
+    is_preferred_hit_direction,
+)
+
+# Costs of typing key j right after key i for the four key pair metrics, computed
+# once from the keyboard layout. Every matrix is indexed [key_ids[i], key_ids[j]]
+# and read-only, so the scorers share them instead of calling the predicates
+# for every pair of every layout.
+
+keys: list[str] = list(qwerty_layout.keys())
+key_ids: dict[str, int] = {key: i for i, key in enumerate(keys)}
+num_keys = len(keys)
+
+
+def get_cost_matrix(cost) -> np.ndarray:
+    costs = np.array(
+        [[cost(i_key, j_key) for j_key in keys] for i_key in keys], dtype=np.float64
+    )
+    costs.setflags(write=False)
+    return costs
+
+
+# 1 for key pairs typed with the same hand
+hand_alternation_costs = get_cost_matrix(lambda i, j: 1 if is_same_hand(i, j) else 0)
+
+# Distance between key pairs typed with the same finger of the same hand
+finger_alternation_costs = get_cost_matrix(
+    lambda i, j: distance(i, j) if is_same_hand(i, j) and is_same_finger(i, j) else 0
+)
+
+# Big step penalty of key pairs typed with the same hand
+big_step_costs = get_cost_matrix(
+    lambda i, j: get_big_step_penalty(i, j) if is_same_hand(i, j) else 0
+)
+
+# 1 for key pairs typed with the same hand against the preferred hit direction
+hit_direction_costs = get_cost_matrix(
+    lambda i, j: 1 if is_same_hand(i, j) and not is_preferred_hit_direction(i, j) else 0
+)
+
+
+def get_key_pair_costs() -> np.ndarray:
+    # One row per pair metric, in the order of the Scores fields
+    # after tapping_workload_distribution, each over all 26 * 26 key pairs
+    costs = np.stack(
+        [
+            hand_alternation_costs,
+            finger_alternation_costs,
+            big_step_costs,
+            hit_direction_costs,
+        ]
+    ).reshape(4, num_keys * num_keys)
+    costs.setflags(write=False)
+    return costs
+
+
+key_pair_costs = get_key_pair_costs()
+
+
+def get_key_pair(i_key: str, j_key: str) -> int:
+    return key_ids[i_key] * num_keys + key_ids[j_key]
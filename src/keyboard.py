@@ -0,0 +1,142 @@
+from enum import IntEnum
+
+# first: 0 = left hand, 1 = right hand
+# second: 1 = index finger, 2 = index finger, 3 = middle finger, 4 = ring finger, 5 = little finger
+# third: 0 = upper row, 1 = home row, 2 = bottom row
+Location = tuple[int, int, int]
+
+Key = str
+
+# Fixed keyboard layout inherited from QWERTY
+
+qwerty_layout: dict[Key, Location] = {
+    # 0-Upper Row
+    "q": (0, 0, 5),
+    "w": (0, 0, 4),
+    "e": (0, 0, 3),
+    "r": (0, 0, 2),
+    "t": (0, 0, 1),
+    "y": (1, 0, 1),
+    "u": (1, 0, 2),
+    "i": (1, 0, 3),
+    "o": (1, 0, 4),
+    "p": (1, 0, 5),
+    # 1-Home Row
+    "a": (0, 1, 5),
+    "s": (0, 1, 4),
+    "d": (0, 1, 3),
+    "f": (0, 1, 2),
+    "g": (0, 1, 1),
+    "h": (1, 1, 1),
+    "j": (1, 1, 2),
+    "k": (1, 1, 3),
+    "l": (1, 1, 4),
+    # 2-Bottom Row
+    "z": (0, 2, 5),
+    "x": (0, 2, 4),
+    "c": (0, 2, 3),
+    "v": (0, 2, 2),
+    "b": (0, 2, 1),
+    "n": (1, 2, 1),
+    "m": (1, 2, 2),
+}
+
+ideal_workload_distribution: dict[tuple[int, int, int], float] = {
+    # 0-Upper Row
+    (0, 0, 5): 1.168,
+    (0, 0, 4): 3.170,
+    (0, 0, 3): 4.060,
+    (0, 0, 2): 2.724,
+    (0, 0, 1): 1.835,
+    (1, 0, 1): 1.835,
+    (1, 0, 2): 2.724,
+    (1, 0, 3): 4.060,
+    (1, 0, 4): 3.170,
+    (1, 0, 5): 1.168,
+    # 1-Home Row
+    (0, 1, 5): 2.854,
+    (0, 1, 4): 7.747,
+    (0, 1, 3): 9.922,
+    (0, 1, 2): 6.657,
+    (0, 1, 1): 4.486,
+    (1, 1, 1): 4.486,
+    (1, 1, 2): 6.657,
+    (1, 1, 3): 9.922,
+    (1, 1, 4): 7.747,
+    # 2-Bottom Row
+    (0, 2, 5): 0.907,
+    (0, 2, 4): 2.463,
+    (0, 2, 3): 3.155,
+    (0, 2, 2): 2.117,
+    (0, 2, 1): 1.427,
+    (1, 2, 1): 1.427,
+    (1, 2, 2): 2.117,
+}
+
+
+class Finger(IntEnum):
+    INDEX = 0
+    MIDDLE = 1
+    RING = 2
+    LITTLE = 3
+
+
+def get_finger(key: Key) -> Finger:
+    i = qwerty_layout[key][1]
+    if i == 1 or i == 2:
+        return Finger.INDEX
+    elif i == 3:
+        return Finger.MIDDLE
+    elif i == 4:
+        return Finger.RING
+    else:
+        return Finger.LITTLE
+
+
+def is_same_finger(i: Key, j: Key) -> bool:
+    return get_finger(i) == get_finger(j)
+
+
+def is_same_hand(i: Key, j: Key) -> bool:
+    return qwerty_layout[i][0] == qwerty_layout[j][0]
+
+
+# Manhattan distance between letter i and letter j
+# distance(i, j) = |col(loc(i)) − col(loc(j))| + |row(loc(i)) − row(loc(j))|
+def distance(i: Key, j: Key) -> int:
+    return abs(qwerty_layout[i][2] - qwerty_layout[j][2]) + abs(
+        qwerty_layout[i][1] - qwerty_layout[j][1]
+    )
+
+
+# Preferred hit direction is from little finger to index finger
+def is_preferred_hit_direction(i: Key, j: Key) -> bool:
+    return get_finger(i) >= get_finger(j)
+
+
+penalty_coefficient_for_big_steps: dict[tuple[Finger, Finger], int] = {
+    # first finger is index
+    (Finger.INDEX, Finger.INDEX): 0,
+    (Finger.INDEX, Finger.MIDDLE): 5,
+    (Finger.INDEX, Finger.RING): 8,
+    (Finger.INDEX, Finger.LITTLE): 6,
+    # second finger is middle
+    (Finger.MIDDLE, Finger.INDEX): 5,
+    (Finger.MIDDLE, Finger.MIDDLE): 0,
+    (Finger.MIDDLE, Finger.RING): 9,
+    (Finger.MIDDLE, Finger.LITTLE): 7,
+    # third finger is ring
+    (Finger.RING, Finger.INDEX): 8,
+    (Finger.RING, Finger.MIDDLE): 9,
+    (Finger.RING, Finger.RING): 0,
+    (Finger.RING, Finger.LITTLE): 10,
+    # fourth finger is little
+    (Finger.LITTLE, Finger.INDEX): 6,
+    (Finger.LITTLE, Finger.MIDDLE): 7,
+    (Finger.LITTLE, Finger.RING): 10,
+    (Finger.LITTLE, Finger.LITTLE): 0,
+}
+
+
+def get_big_step_penalty(i: Key, j: Key) -> int:
+    return penalty_coefficient_for_big_steps[(get_finger(i), get_finger(j))]
@@ -0,0 +1,244 @@
+import numpy as np
+from dataclasses import dataclass, field
+from typing import Optional
+from sketches import CountMinSketch, add_to_sketch, merge_sketches, query_sketch
+
+# Counts of n-grams (n >= 3) of symbol ids, kept sparse because almost all of the
+# len(symbols) ** n possible n-grams never occur. Each n-gram is packed into a single
+# integer code in base len(symbols). Codes are buffered as arrays and folded into
+# the counts in bulk, and when there are more distinct n-grams than `max_size`
+# only the most frequent ones are kept.
+#
+# Pruning makes counts underestimates: every n-gram dropped so far had a count of
+# at most the largest count dropped, so no kept or missing n-gram is undercounted
+# by more than `error_bound`. Merging adds up the error bounds.
+#
+# With a Count-Min sketch, every n-gram is counted in the sketch instead and
+# `counts` only tracks the estimates of the `max_size` most frequent n-grams.
+# Estimates are overestimates, see sketches.get_sketch_error for their bound.
+
+# Codes buffered before they are folded into the counts
+max_pending_codes = 1 << 20
+
+
+@dataclass
+class NgramCounts:
+    n: int
+    num_symbols: int
+    # Number of distinct n-grams to keep, None keeps all of them
+    max_size: Optional[int] = None
+    counts: dict[int, int] = field(default_factory=dict)
+    # Number of n-grams counted, including the ones pruned since
+    total: int = 0
+    error_bound: int = 0
+    pending_codes: list[np.ndarray] = field(default_factory=list, repr=False)
+    num_pending_codes: int = 0
+    sketch: Optional[CountMinSketch] = field(default=None, repr=False)
+
+
+# Largest n whose codes fit in an int64, longer n-grams would overflow
+def get_max_ngram_size(num_symbols: int) -> int:
+    n = 1
+    while num_symbols ** (n + 1) < 2**63:
+        n += 1
+    return n
+
+
+# Counts with the same kind of counting as `ngrams` but nothing counted yet
+def get_empty_ngram_counts(ngrams: NgramCounts) -> NgramCounts:
+    return NgramCounts(
+        ngrams.n,
+        ngrams.num_symbols,
+        ngrams.max_size,
+        sketch=CountMinSketch(
+            ngrams.sketch.width, ngrams.sketch.depth, ngrams.sketch.seed
+        )
+        if ngrams.sketch is not None
+        else None,
+    )
+
+
+# Count the n-grams of a sequence of symbol ids, skipping the ones with
+# an id of -1 (components outside the symbol table)
+def count_ngrams(ids: np.ndarray, ngrams: NgramCounts):
+    n = ngrams.n
+    if len(ids) < n:
+        return
+    windows = np.lib.stride_tricks.sliding_window_view(ids, n)
+    windows = windows[(windows >= 0).all(axis=1)]
+    codes = np.zeros(len(windows), dtype=np.int64)
+    for i in range(n):
+        codes = codes * ngrams.num_symbols + windows[:, i]
+    ngrams.total += len(codes)
+    ngrams.pending_codes.append(codes)
+    ngrams.num_pending_codes += len(codes)
+    if ngrams.num_pending_codes >= max_pending_codes:
+        flush_ngrams(ngrams)
+
+
+def flush_ngrams(ngrams: NgramCounts):
+    if not ngrams.pending_codes:
+        return
+    (codes, counts) = np.unique(
+        np.concatenate(ngrams.pending_codes), return_counts=True
+    )
+    ngrams.pending_codes = []
+    ngrams.num_pending_codes = 0
+    if ngrams.sketch is not None:
+        add_to_sketch(ngrams.sketch, codes, counts)
+        update_top_ngrams(ngrams, codes)
+        return
+    for code, count in zip(codes.tolist(), counts.tolist()):
+        ngrams.counts[code] = ngrams.counts.get(code, 0) + count
+    prune_ngrams(ngrams)
+
+
+# Keep the estimates of the most frequent n-grams among the tracked ones
+# and the newly counted `codes`
+def update_top_ngrams(ngrams: NgramCounts, codes: np.ndarray):
+    candidates = np.union1d(
+        np.fromiter(ngrams.counts.keys(), dtype=np.int64, count=len(ngrams.counts)),
+        codes,
+    )
+    estimates = query_sketch(ngrams.sketch, candidates)
+    if ngrams.max_size is not None and len(candidates) > ngrams.max_size:
+        top = np.argpartition(estimates, -ngrams.max_size)[-ngrams.max_size :]
+        (candidates, estimates) = (candidates[top], estimates[top])
+    ngrams.counts = dict(zip(candidates.tolist(), estimates.tolist()))
+
+
+def prune_ngrams(ngrams: NgramCounts):
+    if ngrams.max_size is None or len(ngrams.counts) <= ngrams.max_size:
+        return
+    by_count = sorted(ngrams.counts.items(), key=lambda item: item[1], reverse=True)
+    ngrams.error_bound += by_count[ngrams.max_size][1]
+    ngrams.counts = dict(by_count[: ngrams.max_size])
+
+
+# Add the counts of `ngrams2` to `ngrams1` in place
+def add_ngram_counts(ngrams1: NgramCounts, ngrams2: NgramCounts):
+    if (ngrams1.n, ngrams1.num_symbols) != (ngrams2.n, ngrams2.num_symbols):
+        raise ValueError(
+            "Cannot add {}-grams over {} symbols to {}-grams over {} symbols".format(
+                ngrams2.n, ngrams2.num_symbols, ngrams1.n, ngrams1.num_symbols
+            )
+        )
+    flush_ngrams(ngrams1)
+    flush_ngrams(ngrams2)
+    ngrams1.total += ngrams2.total
+    ngrams1.error_bound += ngrams2.error_bound
+    if ngrams1.sketch is not None:
+        codes = np.fromiter(
+            ngrams2.counts.keys(), dtype=np.int64, count=len(ngrams2.counts)
+        )
+        if ngrams2.sketch is not None:
+            merge_sketches(ngrams1.sketch, ngrams2.sketch)
+        else:
+            # Exact counts, eg. of a single chunk, go into the sketch as they are
+            add_to_sketch(
+                ngrams1.sketch,
+                codes,
+                np.fromiter(
+                    ngrams2.counts.values(), dtype=np.int64, count=len(ngrams2.counts)
+                ),
+            )
+        update_top_ngrams(ngrams1, codes)
+        return
+    if ngrams2.sketch is not None:
+        raise ValueError("Cannot add sketched n-gram counts to exact ones")
+    for code, count in ngrams2.counts.items():
+        ngrams1.counts[code] = ngrams1.counts.get(code, 0) + count
+    prune_ngrams(ngrams1)
+
+
+def decode_ngram(code: int, n: int, num_symbols: int) -> tuple[int, ...]:
+    ids = []
+    for _ in range(n):
+        (code, symbol_id) = divmod(code, num_symbols)
+        ids.append(symbol_id)
+    return tuple(reversed(ids))
+
+
+def encode_ngram(ids: tuple[int, ...], num_symbols: int) -> int:
+    code = 0
+    for symbol_id in ids:
+        code = code * num_symbols + symbol_id
+    return code
+
+
+# Counts keyed by the symbol names of each n-gram
+def get_named_ngram_counts(
+    ngrams: NgramCounts, symbols: list[str]
+) -> dict[tuple[str, ...], int]:
+    flush_ngrams(ngrams)
+    return {
+        tuple(
+            symbols[symbol_id]
+            for symbol_id in decode_ngram(code, ngrams.n, ngrams.num_symbols)
+        ): count
+        for code, count in ngrams.counts.items()
+    }
+
+
+def ngram_counts_to_arrays(ngrams: NgramCounts) -> dict[str, np.ndarray]:
+    flush_ngrams(ngrams)
+    sketch_arrays = (
+        {
+            "ngram_sketch_table": ngrams.sketch.table,
+            "ngram_sketch_seed": np.int64(ngrams.sketch.seed),
+            "ngram_sketch_total": np.int64(ngrams.sketch.total),
+        }
+        if ngrams.sketch is not None
+        else {}
+    )
+    return {
+        **sketch_arrays,
+        "ngram_size": np.int64(ngrams.n),
+        "ngram_max_size": np.int64(-1 if ngrams.max_size is None else ngrams.max_size),
+        "ngram_codes": np.array(list(ngrams.counts.keys()), dtype=np.int64),
+        "ngram_counts": np.array(list(ngrams.counts.values()), dtype=np.int64),
+        "ngram_total": np.int64(ngrams.total),
+        "ngram_error_bound": np.int64(ngrams.error_bound),
+    }
+
+
+# Inverse of ngram_counts_to_arrays. `symbol_ids` maps the ids of the symbols the
+# arrays were written with to the current ids, with -1 for symbols that no longer exist.
+def ngram_counts_from_arrays(
+    arrays, num_symbols: int, symbol_ids: Optional[list[int]] = None
+) -> NgramCounts:
+    n = int(arrays["ngram_size"])
+    max_size = int(arrays["ngram_max_size"])
+    ngrams = NgramCounts(
+        n,
+        num_symbols,
+        None if max_size < 0 else max_size,
+        total=int(arrays["ngram_total"]),
+        error_bound=int(arrays["ngram_error_bound"]),
+    )
+    codes = arrays["ngram_codes"].tolist()
+    counts = arrays["ngram_counts"].tolist()
+    if "ngram_sketch_table" in arrays:
+        # The hashes of a sketch depend on the symbol ids it was built with
+        if symbol_ids is not None:
+            raise ValueError(
+                "Sketched n-gram counts can only be read with the symbol table they were written with"
+            )
+        table = arrays["ngram_sketch_table"]
+        ngrams.sketch = CountMinSketch(
+            table.shape[1], table.shape[0], int(arrays["ngram_sketch_seed"])
+        )
+        ngrams.sketch.table += table
+        ngrams.sketch.total = int(arrays["ngram_sketch_total"])
+    if symbol_ids is None:
+        ngrams.counts = dict(zip(codes, counts))
+        return ngrams
+    for code, count in zip(codes, counts):
+        ids = tuple(
+            symbol_ids[symbol_id]
+            for symbol_id in decode_ngram(code, n, len(symbol_ids))
+        )
+        if -1 not in ids:
+            code = encode_ngram(ids, num_symbols)
+            ngrams.counts[code] = ngrams.counts.get(code, 0) + count
+    return ngrams
@@ -0,0 +1,148 @@
+import json
+import os
+import time
+from dataclasses import dataclass, field
+from typing import Optional
+
+# Where the time of a frequency run goes. Workers time every stage of every line
+# they process, and the main process times merging the chunk results, so a run
+# tells whether reading, decoding, segmentation or counting is worth tuning.
+
+stage_names = [
+    # Reading and decompressing the bytes of a chunk
+    "read",
+    "decode",
+    "segmentation",
+    "pinyin",
+    # Splitting syllables into initials and finals
+    "split",
+    "counting",
+    # Adding chunk results together, in the main process
+    "merge",
+]
+
+
+def get_zero_seconds() -> dict[str, float]:
+    return dict.fromkeys(stage_names, 0.0)
+
+
+@dataclass
+class StageStats:
+    seconds: dict[str, float] = field(default_factory=get_zero_seconds)
+    lines: int = 0
+    # Size of the (decompressed) text
+    bytes: int = 0
+    # Seconds spent on chunks from start to end, including untimed work
+    busy_seconds: float = 0.0
+
+
+# Add the time since `start` to `stage` and return the current time,
+# so consecutive stages are timed with one clock reading each
+def lap(stats: Optional[StageStats], stage: str, start: float) -> float:
+    now = time.perf_counter()
+    if stats is not None:
+        stats.seconds[stage] += now - start
+    return now
+
+
+# Add the stats of `stats2` to `stats1` in place
+def add_stage_stats(stats1: StageStats, stats2: StageStats):
+    for stage, seconds in stats2.seconds.items():
+        stats1.seconds[stage] += seconds
+    stats1.lines += stats2.lines
+    stats1.bytes += stats2.bytes
+    stats1.busy_seconds += stats2.busy_seconds
+
+
+@dataclass
+class PipelineStats:
+    # Stats of every worker process, by process id
+    workers: dict[int, StageStats] = field(default_factory=dict)
+    # Stats of the main process (merging)
+    main: StageStats = field(default_factory=StageStats)
+    wall_seconds: float = 0.0
+
+
+def add_worker_stats(stats: PipelineStats, pid: int, worker_stats: StageStats):
+    add_stage_stats(stats.workers.setdefault(pid, StageStats()), worker_stats)
+
+
+def get_total_stats(stats: PipelineStats) -> StageStats:
+    total = StageStats()
+    for worker_stats in stats.workers.values():
+        add_stage_stats(total, worker_stats)
+    add_stage_stats(total, stats.main)
+    return total
+
+
+def get_rate(amount: float, seconds: float) -> float:
+    return amount / seconds if seconds > 0 else 0.0
+
+
+def get_stats_report(stats: PipelineStats) -> dict:
+    total = get_total_stats(stats)
+    total_seconds = sum(total.seconds.values())
+    return {
+        "wall_seconds": stats.wall_seconds,
+        "lines": total.lines,
+        "bytes": total.bytes,
+        "lines_per_second": get_rate(total.lines, stats.wall_seconds),
+        "bytes_per_second": get_rate(total.bytes, stats.wall_seconds),
+        # Summed over all processes, so they can add up to more than the wall time
+        "stage_seconds": total.seconds,
+        "stage_shares": {
+            stage: get_rate(seconds, total_seconds)
+            for stage, seconds in total.seconds.items()
+        },
+        "workers": [
+            {
+                "pid": pid,
+                "lines": worker_stats.lines,
+                "bytes": worker_stats.bytes,
+                "busy_seconds": worker_stats.busy_seconds,
+                "lines_per_second": get_rate(
+                    worker_stats.lines, worker_stats.busy_seconds
+                ),
+                "bytes_per_second": get_rate(
+                    worker_stats.bytes, worker_stats.busy_seconds
+                ),
+                "stage_seconds": worker_stats.seconds,
+            }
+            for pid, worker_stats in sorted(stats.workers.items())
+        ],
+    }
+
+
+def print_stats_report(report: dict):
+    print(
+        "Processed {} lines ({:.1f} MB) in {:.1f}s: {:.0f} lines/s, {:.2f} MB/s".format(
+            report["lines"],
+            report["bytes"] / 1e6,
+            report["wall_seconds"],
+            report["lines_per_second"],
+            report["bytes_per_second"] / 1e6,
+        )
+    )
+    for stage in stage_names:
+        print(
+            "  {:<13}{:>10.2f}s {:>6.1f}%".format(
+                stage,
+                report["stage_seconds"][stage],
+                report["stage_shares"][stage] * 100,
+            )
+        )
+    for worker in report["workers"]:
+        print(
+            "  Worker {}: {} lines, {:.0f} lines/s, {:.2f} MB/s".format(
+                worker["pid"],
+                worker["lines"],
+                worker["lines_per_second"],
+                worker["bytes_per_second"] / 1e6,
+            )
+        )
+
+
+def save_stats_report(report: dict, path: str):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w+") as outfile:
+        json.dump(report, outfile, indent=2)
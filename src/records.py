@@ -0,0 +1,38 @@
+import json
+
+# Decoding of the JSON lines corpora. Only the text of a few fields of every record
+# is used, so records are reduced to that text right after parsing. orjson parses
+# faster than the json module and is used when it is installed.
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def get_parser_name() -> str:
+    return "orjson" if orjson is not None else "json"
+
+
+def loads(data):
+    return orjson.loads(data) if orjson is not None else json.loads(data)
+
+
+def get_record_text(record: dict, fields) -> str:
+    return " ".join(map(lambda field: record[field], fields))
+
+
+def decode_text(line, fields) -> str:
+    return get_record_text(loads(line), fields)
+
+
+# Lines of a chunk that hold a record. Chunks of bytes are decoded by the parser
+# itself, which saves decoding the whole chunk to a string first.
+def get_record_lines(data):
+    newline = b"\n" if isinstance(data, bytes) else "\n"
+    return [line for line in data.split(newline) if line.strip()]
+
+
+# Decode the lines of a whole chunk at once, with the parser looked up only once
+def decode_texts(lines: list, fields) -> list[str]:
+    parse = orjson.loads if orjson is not None else json.loads
+    return [get_record_text(parse(line), fields) for line in lines]
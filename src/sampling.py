@@ -0,0 +1,249 @@
+import mmap
+import os
+import numpy as np
+from dataclasses import dataclass, field
+from statistics import NormalDist
+from typing import Optional
+from symbols import ArrayFreqs, add_array_freqs, count_component_lines, symbol_table
+
+# Frequencies estimated from a uniform random sample of lines.
+# Every frequency is a ratio estimate p = sum(c_i) / sum(n_i) over the sampled lines,
+# where c_i counts a symbol (or pair) in line i and n_i counts all symbols (or pairs)
+# in it. Its variance follows from the residuals d_i = c_i - p * n_i:
+#   var(p) = (1 - m / M) * sum(d_i^2) / (m - 1) / (m * mean(n_i)^2)
+# for m sampled lines out of M, and sum(d_i^2) only needs the running sums of
+# c_i^2, c_i * n_i and n_i^2, so lines never have to be kept around.
+
+
+@dataclass
+class SampleOptions:
+    # Largest confidence interval half-width allowed, in percentage points
+    tolerance: float = 0.01
+    confidence: float = 0.95
+    # Lines in the first batch, every batch doubles the sample
+    initial_lines: int = 10000
+    seed: Optional[int] = None
+
+
+def get_zeros(size: int) -> np.ndarray:
+    return np.zeros(size, dtype=np.float64)
+
+
+@dataclass
+class SampleStats:
+    freqs: ArrayFreqs = field(default_factory=ArrayFreqs)
+    num_lines: int = 0
+    # Running sums over the lines of n_i and n_i^2
+    single_totals: int = 0
+    single_total_squares: float = 0.0
+    pair_totals: int = 0
+    pair_total_squares: float = 0.0
+    # Running sums over the lines of c_i^2 and c_i * n_i for every symbol and pair
+    single_squares: np.ndarray = field(
+        default_factory=lambda: get_zeros(len(symbol_table))
+    )
+    single_products: np.ndarray = field(
+        default_factory=lambda: get_zeros(len(symbol_table))
+    )
+    pair_squares: np.ndarray = field(
+        default_factory=lambda: get_zeros(len(symbol_table) ** 2)
+    )
+    pair_products: np.ndarray = field(
+        default_factory=lambda: get_zeros(len(symbol_table) ** 2)
+    )
+
+
+# Count a batch of sampled lines. The per-line counts c_i only matter where they
+# are not 0, so they are counted sparsely as (line, symbol) keys over the whole
+# batch and only their squares and products are added to the dense sums.
+def count_sample_lines(lines: list[list[str]], stats: SampleStats):
+    count_component_lines(lines, stats.freqs)
+    num_symbols = len(symbol_table)
+    single_totals = np.array([len(components) for components in lines], dtype=np.intp)
+    pair_totals = np.maximum(single_totals - 1, 0)
+    ids = np.array(
+        [
+            symbol_table.ids.get(component, -1)
+            for components in lines
+            for component in components
+        ],
+        dtype=np.intp,
+    )
+    line_indices = np.repeat(np.arange(len(lines), dtype=np.intp), single_totals)
+    # Components outside the table only count towards the line totals
+    is_single = ids >= 0
+    add_line_counts(
+        line_indices[is_single],
+        ids[is_single],
+        single_totals,
+        num_symbols,
+        stats.single_squares,
+        stats.single_products,
+    )
+    is_pair = (line_indices[:-1] == line_indices[1:]) & is_single[:-1] & is_single[1:]
+    add_line_counts(
+        line_indices[:-1][is_pair],
+        ids[:-1][is_pair] * num_symbols + ids[1:][is_pair],
+        pair_totals,
+        num_symbols**2,
+        stats.pair_squares,
+        stats.pair_products,
+    )
+    stats.single_totals += int(single_totals.sum())
+    stats.single_total_squares += float((single_totals**2).sum())
+    stats.pair_totals += int(pair_totals.sum())
+    stats.pair_total_squares += float((pair_totals**2).sum())
+    stats.num_lines += len(lines)
+
+
+# Add c_i^2 and c_i * n_i to `squares` and `products` for the counts c_i
+# of the codes in every line i, given the line of every occurrence of a code
+def add_line_counts(
+    line_indices: np.ndarray,
+    codes: np.ndarray,
+    line_totals: np.ndarray,
+    num_codes: int,
+    squares: np.ndarray,
+    products: np.ndarray,
+):
+    (keys, counts) = np.unique(line_indices * num_codes + codes, return_counts=True)
+    (lines, codes) = np.divmod(keys, num_codes)
+    squares += np.bincount(codes, weights=counts**2, minlength=num_codes)
+    products += np.bincount(
+        codes, weights=counts * line_totals[lines], minlength=num_codes
+    )
+
+
+# Add the stats of `stats2` to `stats1` in place
+def add_sample_stats(stats1: SampleStats, stats2: SampleStats):
+    add_array_freqs(stats1.freqs, stats2.freqs)
+    stats1.num_lines += stats2.num_lines
+    stats1.single_totals += stats2.single_totals
+    stats1.single_total_squares += stats2.single_total_squares
+    stats1.pair_totals += stats2.pair_totals
+    stats1.pair_total_squares += stats2.pair_total_squares
+    stats1.single_squares += stats2.single_squares
+    stats1.single_products += stats2.single_products
+    stats1.pair_squares += stats2.pair_squares
+    stats1.pair_products += stats2.pair_products
+
+
+# Percentages and confidence interval half-widths (both in percentage points)
+def estimate_percentages(
+    counts: np.ndarray,
+    totals: int,
+    squares: np.ndarray,
+    products: np.ndarray,
+    total_squares: float,
+    num_lines: int,
+    population_lines: int,
+    z: float,
+) -> tuple[np.ndarray, np.ndarray]:
+    if totals == 0 or num_lines < 2:
+        return (get_zeros(len(counts)), np.full(len(counts), np.inf))
+    p = counts / totals
+    residual_squares = np.maximum(
+        squares - 2 * p * products + p**2 * total_squares, 0.0
+    )
+    mean_total = totals / num_lines
+    finite_population_correction = max(0.0, 1 - num_lines / population_lines)
+    variance = (
+        finite_population_correction
+        * residual_squares
+        / (num_lines - 1)
+        / (num_lines * mean_total**2)
+    )
+    return (p * 100, z * np.sqrt(variance) * 100)
+
+
+def get_z(confidence: float) -> float:
+    return NormalDist().inv_cdf((1 + confidence) / 2)
+
+
+def estimate_single_percentages(
+    stats: SampleStats, population_lines: int, confidence: float
+) -> tuple[np.ndarray, np.ndarray]:
+    return estimate_percentages(
+        stats.freqs.single_counts,
+        stats.single_totals,
+        stats.single_squares,
+        stats.single_products,
+        stats.single_total_squares,
+        stats.num_lines,
+        population_lines,
+        get_z(confidence),
+    )
+
+
+def estimate_pair_percentages(
+    stats: SampleStats, population_lines: int, confidence: float
+) -> tuple[np.ndarray, np.ndarray]:
+    return estimate_percentages(
+        stats.freqs.pair_counts.reshape(-1),
+        stats.pair_totals,
+        stats.pair_squares,
+        stats.pair_products,
+        stats.pair_total_squares,
+        stats.num_lines,
+        population_lines,
+        get_z(confidence),
+    )
+
+
+# Confidence intervals of the symbols and pairs that occurred in the sample,
+# keyed like the JSON frequency files
+def get_confidence_intervals(
+    stats: SampleStats, population_lines: int, confidence: float
+) -> dict:
+    (single_percentages, single_half_widths) = estimate_single_percentages(
+        stats, population_lines, confidence
+    )
+    (pair_percentages, pair_half_widths) = estimate_pair_percentages(
+        stats, population_lines, confidence
+    )
+    num_symbols = len(symbol_table)
+    return {
+        "lines": stats.num_lines,
+        "population_lines": population_lines,
+        "confidence": confidence,
+        "single_freqs": {
+            symbol_table.symbols[i]: [
+                single_percentages[i] - single_half_widths[i],
+                single_percentages[i] + single_half_widths[i],
+            ]
+            for i in np.flatnonzero(stats.freqs.single_counts)
+        },
+        "pair_freqs": {
+            symbol_table.symbols[i // num_symbols]
+            + "+"
+            + symbol_table.symbols[i % num_symbols]: [
+                pair_percentages[i] - pair_half_widths[i],
+                pair_percentages[i] + pair_half_widths[i],
+            ]
+            for i in np.flatnonzero(stats.freqs.pair_counts.reshape(-1))
+        },
+    }
+
+
+# Byte ranges (start, end) of every line of a file, found a block at a time
+def get_line_ranges(
+    file_name: str, block_size: int = 64 * 1024 * 1024
+) -> tuple[np.ndarray, np.ndarray]:
+    file_size = os.path.getsize(file_name)
+    if file_size == 0:
+        return (np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64))
+    starts = [np.zeros(1, dtype=np.int64)]
+    with open(file_name, "rb") as f, mmap.mmap(
+        f.fileno(), 0, access=mmap.ACCESS_READ
+    ) as mm:
+        for block_start in range(0, file_size, block_size):
+            block = np.frombuffer(
+                mm[block_start : block_start + block_size], dtype=np.uint8
+            )
+            starts.append(np.flatnonzero(block == ord("\n")) + block_start + 1)
+    line_starts = np.concatenate(starts)
+    # No line starts after the final newline
+    if line_starts[-1] == file_size:
+        line_starts = line_starts[:-1]
+    line_ends = np.append(line_starts[1:], file_size)
+    return (line_starts, line_ends)
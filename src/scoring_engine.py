@@ -0,0 +1,354 @@
+import numpy as np
+from dataclasses import dataclass, astuple
+from typing import Optional
+from shuangpin import (
+    Choice,
+    Scores,
+    ShuangpinConfig,
+    combine_scores,
+    average_scores,
+    score_weights,
+    is_zero_consonant_final,
+    strip_zero_consonant_final_tag,
+    is_digraph_initial,
+)
+from keyboard import qwerty_layout, ideal_workload_distribution
+from frequency_profiles import FrequencyProfile, get_default_profile
+from key_costs import keys, key_ids, num_keys, key_pair_costs
+
+# A compiled engine scores a layout as a handful of array operations
+# instead of walking the frequency dicts once per metric.
+#
+# Every symbol (initial, final or zero-consonant final) owns two slots:
+#   slot 2 * id + 0 holds the key typed when the symbol is the LEFT choice
+#   slot 2 * id + 1 holds the key typed when the symbol is the RIGHT choice
+# Only zero-consonant finals type different keys in the two slots.
+# A layout is encoded as a vector of key ids, one per slot, so scoring
+# reduces to gathering key ids and summing frequencies over a 26x26 key pair grid.
+
+ideal_key_workload = np.array(
+    [ideal_workload_distribution[qwerty_layout[key]] for key in keys]
+)
+
+
+def get_slot(symbol_id: int, choice: Choice) -> int:
+    return 2 * symbol_id + (0 if choice == Choice.LEFT else 1)
+
+
+@dataclass(frozen=True)
+class ScoringEngine:
+    symbols: list[str]
+    symbol_ids: dict[str, int]
+    # Slots that put tapping workload on their key and the frequency they carry
+    workload_slots: np.ndarray
+    workload_weights: np.ndarray
+    # Consecutive key strokes: the key in the source slot is followed
+    # by the key in the target slot with the given frequency
+    transition_sources: np.ndarray
+    transition_targets: np.ndarray
+    transition_weights: np.ndarray
+    # Per slot lookups used by incremental rescoring:
+    # the workload frequency a slot carries (0 if it carries none)
+    # and the indices of the transitions that start or end in the slot
+    slot_workload_weights: list[float]
+    slot_has_workload: list[bool]
+    slot_outgoing_transitions: list[np.ndarray]
+    slot_incoming_transitions: list[np.ndarray]
+    # Symbols grouped by how their keys are looked up in a config:
+    # (symbol id, final without the zero-consonant tag)
+    zero_consonant_symbols: list[tuple[int, str]]
+    # (symbol id, digraph initial)
+    digraph_initial_symbols: list[tuple[int, str]]
+    # (symbol id, initial or final)
+    plain_symbols: list[tuple[int, str]]
+
+
+def compile_engine(profile: FrequencyProfile) -> ScoringEngine:
+    single_freqs = profile.single_freqs
+    pair_freqs = profile.pair_freqs
+    symbols = list(single_freqs.keys())
+    for pair in pair_freqs:
+        for symbol in pair:
+            if symbol not in single_freqs and symbol not in symbols:
+                symbols.append(symbol)
+    symbol_ids = {symbol: i for i, symbol in enumerate(symbols)}
+
+    workload_slots = []
+    workload_weights = []
+    for symbol, freq in single_freqs.items():
+        symbol_id = symbol_ids[symbol]
+        workload_slots.append(get_slot(symbol_id, Choice.LEFT))
+        workload_weights.append(freq)
+        if is_zero_consonant_final(symbol):
+            # Zero-consonant finals are typed with two keys
+            workload_slots.append(get_slot(symbol_id, Choice.RIGHT))
+            workload_weights.append(freq)
+
+    transition_sources = []
+    transition_targets = []
+    transition_weights = []
+    for (i, j), freq in pair_freqs.items():
+        transition_sources.append(get_slot(symbol_ids[i], Choice.RIGHT))
+        transition_targets.append(get_slot(symbol_ids[j], Choice.LEFT))
+        transition_weights.append(freq)
+    # The two keys of a zero-consonant final form a key pair of their own
+    for symbol, freq in single_freqs.items():
+        if is_zero_consonant_final(symbol):
+            symbol_id = symbol_ids[symbol]
+            transition_sources.append(get_slot(symbol_id, Choice.LEFT))
+            transition_targets.append(get_slot(symbol_id, Choice.RIGHT))
+            transition_weights.append(freq)
+
+    num_slots = 2 * len(symbols)
+    slot_workload_weights = [0.0] * num_slots
+    slot_has_workload = [False] * num_slots
+    for slot, freq in zip(workload_slots, workload_weights):
+        slot_workload_weights[slot] = freq
+        slot_has_workload[slot] = True
+    slot_outgoing_transitions: list[list[int]] = [[] for _ in range(num_slots)]
+    slot_incoming_transitions: list[list[int]] = [[] for _ in range(num_slots)]
+    for t, (source, target) in enumerate(zip(transition_sources, transition_targets)):
+        slot_outgoing_transitions[source].append(t)
+        slot_incoming_transitions[target].append(t)
+
+    return ScoringEngine(
+        symbols=symbols,
+        symbol_ids=symbol_ids,
+        workload_slots=np.array(workload_slots, dtype=np.intp),
+        workload_weights=np.array(workload_weights, dtype=np.float64),
+        transition_sources=np.array(transition_sources, dtype=np.intp),
+        transition_targets=np.array(transition_targets, dtype=np.intp),
+        transition_weights=np.array(transition_weights, dtype=np.float64),
+        slot_workload_weights=slot_workload_weights,
+        slot_has_workload=slot_has_workload,
+        slot_outgoing_transitions=[
+            np.array(ts, dtype=np.intp) for ts in slot_outgoing_transitions
+        ],
+        slot_incoming_transitions=[
+            np.array(ts, dtype=np.intp) for ts in slot_incoming_transitions
+        ],
+        zero_consonant_symbols=[
+            (symbol_id, strip_zero_consonant_final_tag(symbol))
+            for symbol_id, symbol in enumerate(symbols)
+            if is_zero_consonant_final(symbol)
+        ],
+        digraph_initial_symbols=[
+            (symbol_id, symbol)
+            for symbol_id, symbol in enumerate(symbols)
+            if is_digraph_initial(symbol)
+        ],
+        plain_symbols=[
+            (symbol_id, symbol)
+            for symbol_id, symbol in enumerate(symbols)
+            if not is_zero_consonant_final(symbol) and not is_digraph_initial(symbol)
+        ],
+    )
+
+
+def encode_config(engine: ScoringEngine, config: ShuangpinConfig) -> np.ndarray:
+    return np.array(encode_config_slots(engine, config), dtype=np.intp)
+
+
+# Key ids of every slot in slot order, kept as a plain list
+# so that encoding many layouts only builds a single array at the end
+def encode_config_slots(engine: ScoringEngine, config: ShuangpinConfig) -> list[int]:
+    slot_keys = [0] * (2 * len(engine.symbols))
+    # Slots are laid out as LEFT then RIGHT, see get_slot
+    for symbol_id, final in engine.zero_consonant_symbols:
+        (left_key, right_key) = config.zero_consonant_final_layout[final]
+        slot_keys[2 * symbol_id] = key_ids[left_key]
+        slot_keys[2 * symbol_id + 1] = key_ids[right_key]
+    for symbol_id, initial in engine.digraph_initial_symbols:
+        slot_keys[2 * symbol_id] = slot_keys[2 * symbol_id + 1] = key_ids[
+            config.digraph_initial_layout[initial]
+        ]
+    for symbol_id, symbol in engine.plain_symbols:
+        standard_final = config.variant_to_standard_finals.get(symbol, symbol)
+        slot_keys[2 * symbol_id] = slot_keys[2 * symbol_id + 1] = key_ids[
+            config.final_layout.get(standard_final, standard_final)
+        ]
+    return slot_keys
+
+
+# Number of layouts scored together, bounds the size of the gathered key pair matrix
+score_batch_size = 2048
+
+
+def score_slot_key_matrix(engine: ScoringEngine, slot_keys: np.ndarray) -> np.ndarray:
+    # Scores every row of slot_keys (one encoded layout per row) at once
+    # and returns one row of the five Scores metrics per layout
+    scores = np.empty((len(slot_keys), 5))
+    for start in range(0, len(slot_keys), score_batch_size):
+        batch = slot_keys[start : start + score_batch_size]
+        # Offset each row into its own block of keys (or key pairs)
+        # so that a single bincount aggregates all rows of the batch
+        row_offsets = np.arange(len(batch))[:, np.newaxis]
+
+        workload_keys = batch[:, engine.workload_slots] + row_offsets * num_keys
+        key_freqs = np.bincount(
+            workload_keys.ravel(),
+            weights=np.broadcast_to(
+                engine.workload_weights, workload_keys.shape
+            ).ravel(),
+            minlength=len(batch) * num_keys,
+        ).reshape(len(batch), num_keys)
+        # Keys without any symbol are not part of the workload distribution
+        used_keys = (
+            np.bincount(workload_keys.ravel(), minlength=len(batch) * num_keys).reshape(
+                len(batch), num_keys
+            )
+            > 0
+        )
+        scores[start : start + len(batch), 0] = np.sum(
+            np.where(used_keys, ((key_freqs - ideal_key_workload) / 100) ** 2, 0),
+            axis=1,
+        )
+
+        key_pairs = (
+            batch[:, engine.transition_sources] * num_keys
+            + batch[:, engine.transition_targets]
+            + row_offsets * num_keys * num_keys
+        )
+        key_pair_freqs = np.bincount(
+            key_pairs.ravel(),
+            weights=np.broadcast_to(engine.transition_weights, key_pairs.shape).ravel(),
+            minlength=len(batch) * num_keys * num_keys,
+        ).reshape(len(batch), num_keys * num_keys)
+        scores[start : start + len(batch), 1:] = key_pair_freqs @ key_pair_costs.T / 100
+    return scores
+
+
+def score_slot_keys(engine: ScoringEngine, slot_keys: np.ndarray) -> np.ndarray:
+    return score_slot_key_matrix(engine, slot_keys[np.newaxis, :])[0]
+
+
+# Vectorized combine_scores over rows of the five Scores metrics
+score_combination_weights = np.array(astuple(score_weights)) / np.array(
+    astuple(average_scores)
+)
+
+
+def combine_score_matrix(scores: np.ndarray) -> np.ndarray:
+    return scores @ score_combination_weights
+
+
+# Everything needed to rescore a layout after changing a few of its slots
+@dataclass
+class ScoreCache:
+    slot_keys: np.ndarray
+    # Tapping workload and number of workload slots per key
+    key_freqs: np.ndarray
+    key_slot_counts: np.ndarray
+    # The five Scores metrics and their combined score
+    scores: np.ndarray
+    score: float
+
+
+def get_workload_distribution(
+    key_freqs: np.ndarray, key_slot_counts: np.ndarray
+) -> float:
+    deviations = (key_freqs - ideal_key_workload) / 100
+    # Keys without any symbol are not part of the workload distribution
+    return float(deviations * deviations @ (key_slot_counts > 0))
+
+
+def cache_scores(engine: ScoringEngine, slot_keys: np.ndarray) -> ScoreCache:
+    workload_keys = slot_keys[engine.workload_slots]
+    scores = score_slot_keys(engine, slot_keys)
+    return ScoreCache(
+        slot_keys=slot_keys,
+        key_freqs=np.bincount(
+            workload_keys, weights=engine.workload_weights, minlength=num_keys
+        ),
+        key_slot_counts=np.bincount(workload_keys, minlength=num_keys),
+        scores=scores,
+        score=float(combine_score_matrix(scores)),
+    )
+
+
+# Rescore a layout that differs from the cached one only in the given
+# slot -> key id assignments. Only the workload of the changed slots and
+# the transitions touching them are revisited, so the cost grows with the
+# number of changed slots instead of the number of symbol pairs.
+def rescore(
+    engine: ScoringEngine, cache: ScoreCache, changes: dict[int, int]
+) -> ScoreCache:
+    old_slot_keys = cache.slot_keys.tolist()
+    changes = {slot: key for slot, key in changes.items() if old_slot_keys[slot] != key}
+    if len(changes) == 0:
+        return cache
+    changed_slots = list(changes.keys())
+    slot_keys = cache.slot_keys.copy()
+    slot_keys[changed_slots] = list(changes.values())
+
+    key_freqs = cache.key_freqs.copy()
+    key_slot_counts = cache.key_slot_counts.copy()
+    for slot, new_key in changes.items():
+        if engine.slot_has_workload[slot]:
+            old_key = old_slot_keys[slot]
+            key_freqs[old_key] -= engine.slot_workload_weights[slot]
+            key_freqs[new_key] += engine.slot_workload_weights[slot]
+            key_slot_counts[old_key] -= 1
+            key_slot_counts[new_key] += 1
+
+    # A transition between two changed slots is only taken
+    # from the outgoing transitions of its source
+    outgoing = np.concatenate(
+        [engine.slot_outgoing_transitions[slot] for slot in changed_slots]
+    )
+    incoming = np.concatenate(
+        [engine.slot_incoming_transitions[slot] for slot in changed_slots]
+    )
+    is_changed = np.zeros(len(old_slot_keys), dtype=bool)
+    is_changed[changed_slots] = True
+    transitions = np.concatenate(
+        [outgoing, incoming[~is_changed[engine.transition_sources[incoming]]]]
+    )
+    sources = engine.transition_sources[transitions]
+    targets = engine.transition_targets[transitions]
+    old_key_pairs = cache.slot_keys[sources] * num_keys + cache.slot_keys[targets]
+    new_key_pairs = slot_keys[sources] * num_keys + slot_keys[targets]
+    weights = engine.transition_weights[transitions]
+    pair_deltas = key_pair_costs @ (
+        np.bincount(new_key_pairs, weights=weights, minlength=num_keys * num_keys)
+        - np.bincount(old_key_pairs, weights=weights, minlength=num_keys * num_keys)
+    )
+
+    scores = cache.scores.copy()
+    scores[0] = get_workload_distribution(key_freqs, key_slot_counts)
+    scores[1:] += pair_deltas / 100
+    return ScoreCache(
+        slot_keys=slot_keys,
+        key_freqs=key_freqs,
+        key_slot_counts=key_slot_counts,
+        scores=scores,
+        score=float(scores @ score_combination_weights),
+    )
+
+
+def scores_from_array(scores: np.ndarray) -> Scores:
+    return Scores(*map(float, scores))
+
+
+def get_compiled_scores(
+    config: ShuangpinConfig, engine: Optional[ScoringEngine] = None
+) -> Scores:
+    engine = get_default_engine() if engine is None else engine
+    return scores_from_array(score_slot_keys(engine, encode_config(engine, config)))
+
+
+def get_compiled_score(
+    config: ShuangpinConfig, engine: Optional[ScoringEngine] = None
+) -> float:
+    return combine_scores(get_compiled_scores(config, engine))
+
+
+default_engine: Optional[ScoringEngine] = None
+
+
+# Engine of the default profile, compiled on first use
+def get_default_engine() -> ScoringEngine:
+    global default_engine
+    if default_engine is None:
+        default_engine = compile_engine(get_default_profile())
+    return default_engine
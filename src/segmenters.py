@@ -0,0 +1,114 @@
+from abc import ABC, abstractmethod
+from typing import Iterable, Iterator, Optional
+
+
+# Splits text into the words that are converted to Pinyin one at a time
+class Segmenter(ABC):
+    # Whether segment() returns words. If not, the text is handed to pypinyin
+    # as a whole and pypinyin splits it with its own phrase dictionary.
+    segments_words = True
+
+    # Create the segmenter from the command line options
+    @classmethod
+    def create(cls, dictionary_path: Optional[str] = None) -> "Segmenter":
+        return cls()
+
+    @abstractmethod
+    def segment(self, text: str) -> list[str]:
+        pass
+
+    # The words of every text in order, segmenters that can process several
+    # texts at once take them `batch_size` at a time
+    def segment_texts(
+        self, texts: Iterable[str], batch_size: int = 1000
+    ) -> Iterator[list[str]]:
+        for text in texts:
+            yield self.segment(text)
+
+
+# PKUSeg with "mixed" model provided by pkuseg
+class PkusegSegmenter(Segmenter):
+    def __init__(self, model: str = "mixed"):
+        from spacy.lang.zh import Chinese
+
+        cfg = {"segmenter": "pkuseg"}
+        self.nlp = Chinese.from_config({"nlp": {"tokenizer": cfg}})
+        self.nlp.tokenizer.initialize(pkuseg_model=model)
+
+    def segment(self, text: str) -> list[str]:
+        return list(map(lambda token: token.text, self.nlp(text)))
+
+    # The pipeline only has the tokenizer, so piping the texts only saves the
+    # overhead of calling the pipeline for every text
+    def segment_texts(
+        self, texts: Iterable[str], batch_size: int = 1000
+    ) -> Iterator[list[str]]:
+        for doc in self.nlp.pipe(texts, batch_size=batch_size):
+            yield [token.text for token in doc]
+
+
+# Forward maximum matching against a word list,
+# defaults to the phrases pypinyin knows the Pinyin of
+class MaxMatchSegmenter(Segmenter):
+    def __init__(self, words: Optional[Iterable[str]] = None, max_word_length: int = 8):
+        if words is None:
+            from pypinyin.constants import PHRASES_DICT
+
+            words = PHRASES_DICT.keys()
+        self.words = {word for word in words if 1 < len(word) <= max_word_length}
+        # Only try the lengths that some word actually has, longest first
+        self.word_lengths = sorted({len(word) for word in self.words}, reverse=True)
+
+    @classmethod
+    def create(cls, dictionary_path: Optional[str] = None) -> "MaxMatchSegmenter":
+        return cls(
+            load_dictionary(dictionary_path) if dictionary_path is not None else None
+        )
+
+    def segment(self, text: str) -> list[str]:
+        words = []
+        start = 0
+        while start < len(text):
+            end = start + 1
+            for length in self.word_lengths:
+                if text[start : start + length] in self.words:
+                    end = start + length
+                    break
+            words.append(text[start:end])
+            start = end
+        return words
+
+
+# No segmentation of our own, pypinyin matches its phrase dictionary
+# character by character while converting the text
+class CharacterSegmenter(Segmenter):
+    segments_words = False
+
+    def segment(self, text: str) -> list[str]:
+        return [text]
+
+
+segmenter_classes: dict[str, type[Segmenter]] = {
+    "pkuseg": PkusegSegmenter,
+    "maxmatch": MaxMatchSegmenter,
+    "character": CharacterSegmenter,
+}
+
+segmenter_names: list[str] = list(segmenter_classes.keys())
+
+
+def load_dictionary(path: str) -> list[str]:
+    # One word per line, anything after the first whitespace
+    # (frequencies, part of speech tags) is ignored
+    with open(path, "r") as infile:
+        return [line.split()[0] for line in infile if line.strip()]
+
+
+def create_segmenter(name: str, dictionary_path: Optional[str] = None) -> Segmenter:
+    if name not in segmenter_classes:
+        raise ValueError(
+            'Unknown segmenter "{}", expected one of {}'.format(
+                name, ", ".join(segmenter_names)
+            )
+        )
+    return segmenter_classes[name].create(dictionary_path)
@@ -1,93 +1,13 @@
-import json
-from enum import Enum, IntEnum
+from enum import Enum
 from dataclasses import dataclass
 import random
+import numpy as np
 from itertools import product
 from typing import Optional
 from final_groups import only_jqx_final, no_jqx_group, only_gkh_group, no_gkh_group
-
-# first: 0 = left hand, 1 = right hand
-# second: 1 = index finger, 2 = index finger, 3 = middle finger, 4 = ring finger, 5 = little finger
-# third: 0 = upper row, 1 = home row, 2 = bottom row
-Location = tuple[int, int, int]
-
-Key = str
-
-# Fixed keyboard layout inherited from QWERTY
-
-qwerty_layout: dict[Key, Location] = {
-    # 0-Upper Row
-    "q": (0, 0, 5),
-    "w": (0, 0, 4),
-    "e": (0, 0, 3),
-    "r": (0, 0, 2),
-    "t": (0, 0, 1),
-    "y": (1, 0, 1),
-    "u": (1, 0, 2),
-    "i": (1, 0, 3),
-    "o": (1, 0, 4),
-    "p": (1, 0, 5),
-    # 1-Home Row
-    "a": (0, 1, 5),
-    "s": (0, 1, 4),
-    "d": (0, 1, 3),
-    "f": (0, 1, 2),
-    "g": (0, 1, 1),
-    "h": (1, 1, 1),
-    "j": (1, 1, 2),
-    "k": (1, 1, 3),
-    "l": (1, 1, 4),
-    # 2-Bottom Row
-    "z": (0, 2, 5),
-    "x": (0, 2, 4),
-    "c": (0, 2, 3),
-    "v": (0, 2, 2),
-    "b": (0, 2, 1),
-    "n": (1, 2, 1),
-    "m": (1, 2, 2),
-}
-
-ideal_workload_distribution: dict[tuple[int, int, int], float] = {
-    # 0-Upper Row
-    (0, 0, 5): 1.168,
-    (0, 0, 4): 3.170,
-    (0, 0, 3): 4.060,
-    (0, 0, 2): 2.724,
-    (0, 0, 1): 1.835,
-    (1, 0, 1): 1.835,
-    (1, 0, 2): 2.724,
-    (1, 0, 3): 4.060,
-    (1, 0, 4): 3.170,
-    (1, 0, 5): 1.168,
-    # 1-Home Row
-    (0, 1, 5): 2.854,
-    (0, 1, 4): 7.747,
-    (0, 1, 3): 9.922,
-    (0, 1, 2): 6.657,
-    (0, 1, 1): 4.486,
-    (1, 1, 1): 4.486,
-    (1, 1, 2): 6.657,
-    (1, 1, 3): 9.922,
-    (1, 1, 4): 7.747,
-    # 2-Bottom Row
-    (0, 2, 5): 0.907,
-    (0, 2, 4): 2.463,
-    (0, 2, 3): 3.155,
-    (0, 2, 2): 2.117,
-    (0, 2, 1): 1.427,
-    (1, 2, 1): 1.427,
-    (1, 2, 2): 2.117,
-}
-
-single_freqs: dict[str, float] = json.load(
-    open("../results/zhihu/frequencies/single_freqs.json", "r")
-)
-pair_freqs: dict[tuple[str, str], float] = {
-    tuple(k.split("+")): v
-    for k, v in json.load(
-        open("../results/zhihu/frequencies/pair_freqs.json", "r")
-    ).items()
-}
+from frequency_profiles import FrequencyProfile, get_default_profile
+from keyboard import Key, qwerty_layout, ideal_workload_distribution
+from key_costs import num_keys, key_pair_costs, get_key_pair
 
 
 class Choice(Enum):
@@ -107,74 +27,6 @@ def add_zero_consonant_final_tag(final: str) -> str:
     return final + "F"
 
 
-class Finger(IntEnum):
-    INDEX = 0
-    MIDDLE = 1
-    RING = 2
-    LITTLE = 3
-
-
-def get_finger(key: Key) -> Finger:
-    i = qwerty_layout[key][1]
-    if i == 1 or i == 2:
-        return Finger.INDEX
-    elif i == 3:
-        return Finger.MIDDLE
-    elif i == 4:
-        return Finger.RING
-    else:
-        return Finger.LITTLE
-
-
-def is_same_finger(i: Key, j: Key) -> bool:
-    return get_finger(i) == get_finger(j)
-
-
-def is_same_hand(i: Key, j: Key) -> bool:
-    return qwerty_layout[i][0] == qwerty_layout[j][0]
-
-
-# Manhattan distance between letter i and letter j
-# distance(i, j) = |col(loc(i)) − col(loc(j))| + |row(loc(i)) − row(loc(j))|
-def distance(i: Key, j: Key) -> int:
-    return abs(qwerty_layout[i][2] - qwerty_layout[j][2]) + abs(
-        qwerty_layout[i][1] - qwerty_layout[j][1]
-    )
-
-
-# Preferred hit direction is from little finger to index finger
-def is_preferred_hit_direction(i: Key, j: Key) -> bool:
-    return get_finger(i) >= get_finger(j)
-
-
-penalty_coefficient_for_big_steps: dict[tuple[Finger, Finger], int] = {
-    # first finger is index
-    (Finger.INDEX, Finger.INDEX): 0,
-    (Finger.INDEX, Finger.MIDDLE): 5,
-    (Finger.INDEX, Finger.RING): 8,
-    (Finger.INDEX, Finger.LITTLE): 6,
-    # second finger is middle
-    (Finger.MIDDLE, Finger.INDEX): 5,
-    (Finger.MIDDLE, Finger.MIDDLE): 0,
-    (Finger.MIDDLE, Finger.RING): 9,
-    (Finger.MIDDLE, Finger.LITTLE): 7,
-    # third finger is ring
-    (Finger.RING, Finger.INDEX): 8,
-    (Finger.RING, Finger.MIDDLE): 9,
-    (Finger.RING, Finger.RING): 0,
-    (Finger.RING, Finger.LITTLE): 10,
-    # fourth finger is little
-    (Finger.LITTLE, Finger.INDEX): 6,
-    (Finger.LITTLE, Finger.MIDDLE): 7,
-    (Finger.LITTLE, Finger.RING): 10,
-    (Finger.LITTLE, Finger.LITTLE): 0,
-}
-
-
-def get_big_step_penalty(i: Key, j: Key) -> int:
-    return penalty_coefficient_for_big_steps[(get_finger(i), get_finger(j))]
-
-
 @dataclass
 class ShuangpinConfig:
     # Maps standard finals to keys
@@ -486,32 +338,58 @@ def get_random_config(
         )
 
 
-def get_score(
-    config: ShuangpinConfig,
-) -> float:
-    scores = get_scores(config)
-    # Generated using get_average_scores(4000)
-    average_scores = Scores(
-        tapping_workload_distribution=0.025301075426633263,
-        hand_alternation=0.5841655834657751,
-        finger_alternation=0.5459557691028307,
-        avoidance_of_big_steps=1.6827515700073905,
-        hit_direction=0.12495240024105278,
-    )
+# Generated using get_average_scores(4000)
+average_scores = Scores(
+    tapping_workload_distribution=0.025301075426633263,
+    hand_alternation=0.5841655834657751,
+    finger_alternation=0.5459557691028307,
+    avoidance_of_big_steps=1.6827515700073905,
+    hit_direction=0.12495240024105278,
+)
+
+score_weights = Scores(
+    tapping_workload_distribution=0.45,
+    hand_alternation=1.0,
+    finger_alternation=0.8,
+    avoidance_of_big_steps=0.7,
+    hit_direction=0.6,
+)
+
+
+def combine_scores(scores: Scores) -> float:
     return (
         scores.tapping_workload_distribution
         / average_scores.tapping_workload_distribution
-        * 0.45
-        + scores.hand_alternation / average_scores.hand_alternation * 1.0
-        + scores.finger_alternation / average_scores.finger_alternation * 0.8
-        + scores.avoidance_of_big_steps / average_scores.avoidance_of_big_steps * 0.7
-        + scores.hit_direction / average_scores.hit_direction * 0.6
+        * score_weights.tapping_workload_distribution
+        + scores.hand_alternation
+        / average_scores.hand_alternation
+        * score_weights.hand_alternation
+        + scores.finger_alternation
+        / average_scores.finger_alternation
+        * score_weights.finger_alternation
+        + scores.avoidance_of_big_steps
+        / average_scores.avoidance_of_big_steps
+        * score_weights.avoidance_of_big_steps
+        + scores.hit_direction
+        / average_scores.hit_direction
+        * score_weights.hit_direction
     )
 
 
+def get_score(
+    config: ShuangpinConfig,
+    profile: Optional[FrequencyProfile] = None,
+) -> float:
+    return combine_scores(get_scores(config, profile))
+
+
+# Scores the layout against the frequencies of `profile`, defaults to the Zhihu frequencies
 def get_scores(
     config: ShuangpinConfig,
+    profile: Optional[FrequencyProfile] = None,
 ) -> Scores:
+    profile = get_default_profile() if profile is None else profile
+
     def get_standard_final(final: str) -> str:
         return config.variant_to_standard_finals.get(final, final)
 
@@ -527,8 +405,8 @@ def get_scores(
             standard_final = get_standard_final(i)
             return config.final_layout.get(standard_final, standard_final)
 
-    standard_single_freqs: dict[str, float] = single_freqs.copy()
-    standard_pair_freqs: dict[tuple[str, str], float] = pair_freqs.copy()
+    standard_single_freqs: dict[str, float] = profile.single_freqs.copy()
+    standard_pair_freqs: dict[tuple[str, str], float] = profile.pair_freqs.copy()
 
     for variant, standard in config.variant_to_standard_finals.items():
         standard_single_freqs[standard] += standard_single_freqs[variant]
@@ -563,86 +441,41 @@ def get_scores(
             I1 += ((freq - ideal_workload_distribution[key_location]) / 100) ** 2
         return I1
 
-    def hand_alternation() -> float:
-        I2 = 0.0
-        for (i, j) in standard_pair_freqs:
-            i_key = get_key(i, Choice.RIGHT)
-            j_key = get_key(j, Choice.LEFT)
-            if is_same_hand(i_key, j_key):
-                # Gives penalty if the two keys are on the same hand
-                I2 += standard_pair_freqs[(i, j)]
-        # add zero-consonant hand alternations
-        for final, key_pair in config.zero_consonant_final_layout.items():
-            if is_same_hand(key_pair[0], key_pair[1]):
-                I2 += standard_single_freqs.get(add_zero_consonant_final_tag(final), 0)
-        return I2 / 100
-
-    def finger_alternation() -> float:
-        I3 = 0.0
-        for (i, j) in standard_pair_freqs:
-            i_key = get_key(i, Choice.RIGHT)
-            j_key = get_key(j, Choice.LEFT)
-            if is_same_hand(i_key, j_key) and is_same_finger(i_key, j_key):
-                # Gives penalty if the pair is on the same hand and the same finger
-                I3 += standard_pair_freqs[(i, j)] * distance(i_key, j_key)
-        # add zero-consonant finger alternations
-        for final, key_pair in config.zero_consonant_final_layout.items():
-            if is_same_hand(key_pair[0], key_pair[1]) and is_same_finger(
-                key_pair[0], key_pair[1]
-            ):
-                I3 += standard_single_freqs.get(
-                    add_zero_consonant_final_tag(final), 0
-                ) * distance(key_pair[0], key_pair[1])
-        return I3 / 100
-
-    def avoidance_of_big_steps() -> float:
-        I4 = 0.0
-        for (i, j) in standard_pair_freqs:
-            i_key = get_key(i, Choice.RIGHT)
-            j_key = get_key(j, Choice.LEFT)
-            if is_same_hand(i_key, j_key):
-                # Gives penalty if the pair is on the same hand
-                I4 += standard_pair_freqs[(i, j)] * get_big_step_penalty(i_key, j_key)
-        # add zero-consonant finger alternations
-        for final, key_pair in config.zero_consonant_final_layout.items():
-            if is_same_hand(key_pair[0], key_pair[1]):
-                I4 += standard_single_freqs.get(
-                    add_zero_consonant_final_tag(final), 0
-                ) * get_big_step_penalty(key_pair[0], key_pair[1])
-        return I4 / 100
-
-    def hit_direction() -> float:
-        I5 = 0.0
-        for (i, j) in standard_pair_freqs:
-            i_key = get_key(i, Choice.RIGHT)
-            j_key = get_key(j, Choice.LEFT)
-            if is_same_hand(i_key, j_key) and not is_preferred_hit_direction(
-                i_key, j_key
-            ):
-                # Gives penalty if the pair is on the same hand and not in preferred hit direction
-                I5 += standard_pair_freqs[(i, j)]
-        # add zero-consonant finger alternations
-        for final, key_pair in config.zero_consonant_final_layout.items():
-            if is_same_hand(
-                key_pair[0], key_pair[1]
-            ) and not is_preferred_hit_direction(key_pair[0], key_pair[1]):
-                I5 += standard_single_freqs.get(add_zero_consonant_final_tag(final), 0)
-        return I5 / 100
+    # Frequencies of consecutive key strokes over all 26 * 26 key pairs,
+    # including the two keys of every zero-consonant final
+    key_pairs = [
+        get_key_pair(get_key(i, Choice.RIGHT), get_key(j, Choice.LEFT))
+        for (i, j) in standard_pair_freqs
+    ] + [
+        get_key_pair(first_key, second_key)
+        for (first_key, second_key) in config.zero_consonant_final_layout.values()
+    ]
+    key_pair_weights = list(standard_pair_freqs.values()) + [
+        standard_single_freqs.get(add_zero_consonant_final_tag(final), 0)
+        for final in config.zero_consonant_final_layout
+    ]
+    key_pair_freqs = np.bincount(
+        key_pairs, weights=key_pair_weights, minlength=num_keys * num_keys
+    )
+    # Hand alternation, finger alternation, avoidance of big steps and hit direction
+    pair_scores = key_pair_costs @ key_pair_freqs / 100
 
     return Scores(
         tapping_workload_distribution=tapping_workload_distribution(),
-        hand_alternation=hand_alternation(),
-        finger_alternation=finger_alternation(),
-        avoidance_of_big_steps=avoidance_of_big_steps(),
-        hit_direction=hit_direction(),
+        hand_alternation=float(pair_scores[0]),
+        finger_alternation=float(pair_scores[1]),
+        avoidance_of_big_steps=float(pair_scores[2]),
+        hit_direction=float(pair_scores[3]),
     )
 
 
-def get_average_scores(num_of_random_scores: int) -> Scores:
+def get_average_scores(
+    num_of_random_scores: int, profile: Optional[FrequencyProfile] = None
+) -> Scores:
     total_scores = Scores(0, 0, 0, 0, 0)
     for _ in range(num_of_random_scores):
         config = get_random_config()
-        total_scores += get_scores(config)
+        total_scores += get_scores(config, profile)
     return total_scores / num_of_random_scores
 
 
@@ -0,0 +1,113 @@
+import math
+import numpy as np
+from dataclasses import dataclass, field
+
+# Count-Min sketch over integer keys: `depth` rows of `width` counters, each row
+# indexed by its own hash of the key. A key's estimate is the smallest of its
+# counters, which never underestimates and with probability 1 - exp(-depth)
+# overestimates by at most e / width of the total count. Sketches with the
+# same dimensions and seed are merged by adding their tables, so memory stays
+# fixed no matter how many keys the corpus has.
+
+mersenne_exponent = 61
+mersenne_prime = (1 << mersenne_exponent) - 1
+
+
+@dataclass
+class CountMinSketch:
+    width: int
+    depth: int = 4
+    seed: int = 0
+    table: np.ndarray = field(init=False, repr=False)
+    total: int = 0
+
+    def __post_init__(self):
+        self.table = np.zeros((self.depth, self.width), dtype=np.int64)
+
+
+# Hash functions h(x) = ((a * x + b) mod p) mod width with p = 2^61 - 1.
+# Keys and coefficients are split into 31 and 30 bit halves so that every
+# product fits into 64 bits.
+def get_hash_coefficients(sketch: CountMinSketch) -> np.ndarray:
+    rng = np.random.default_rng(sketch.seed)
+    return rng.integers(1, mersenne_prime, size=(sketch.depth, 2), dtype=np.int64)
+
+
+def mod_mersenne(x: np.ndarray) -> np.ndarray:
+    x = (x & mersenne_prime) + (x >> mersenne_exponent)
+    return np.where(x >= mersenne_prime, x - mersenne_prime, x)
+
+
+# 2^k * x (mod p) for x < p, by rotating the 61 bits of x
+def shift_mod_mersenne(x: np.ndarray, k: int) -> np.ndarray:
+    return ((x & ((1 << (mersenne_exponent - k)) - 1)) << k) + (
+        x >> (mersenne_exponent - k)
+    )
+
+
+def multiply_mod_mersenne(a: int, x: np.ndarray) -> np.ndarray:
+    # a * x = (a_high * 2^31 + a_low) * (x_high * 2^30 + x_low) for a, x < 2^61,
+    # every partial product is below 2^62
+    (a_high, a_low) = (np.int64(a >> 31), np.int64(a & ((1 << 31) - 1)))
+    (x_high, x_low) = (x >> 30, x & ((1 << 30) - 1))
+    # 2^61 = 1 (mod p)
+    high = mod_mersenne(a_high * x_high)
+    middle = mod_mersenne(
+        shift_mod_mersenne(mod_mersenne(a_high * x_low), 31)
+        + shift_mod_mersenne(mod_mersenne(a_low * x_high), 30)
+    )
+    low = mod_mersenne(a_low * x_low)
+    return mod_mersenne(mod_mersenne(high + middle) + low)
+
+
+def get_columns(sketch: CountMinSketch, keys: np.ndarray) -> np.ndarray:
+    keys = mod_mersenne(np.asarray(keys, dtype=np.int64))
+    return np.array(
+        [
+            mod_mersenne(multiply_mod_mersenne(int(a), keys) + np.int64(b))
+            % sketch.width
+            for (a, b) in get_hash_coefficients(sketch)
+        ]
+    )
+
+
+def add_to_sketch(sketch: CountMinSketch, keys: np.ndarray, counts: np.ndarray):
+    for row, columns in enumerate(get_columns(sketch, keys)):
+        np.add.at(sketch.table[row], columns, counts)
+    sketch.total += int(np.sum(counts))
+
+
+def query_sketch(sketch: CountMinSketch, keys: np.ndarray) -> np.ndarray:
+    if len(keys) == 0:
+        return np.zeros(0, dtype=np.int64)
+    return np.min(
+        [
+            sketch.table[row, columns]
+            for row, columns in enumerate(get_columns(sketch, keys))
+        ],
+        axis=0,
+    )
+
+
+# Add the counts of `sketch2` to `sketch1` in place
+def merge_sketches(sketch1: CountMinSketch, sketch2: CountMinSketch):
+    if (sketch1.width, sketch1.depth, sketch1.seed) != (
+        sketch2.width,
+        sketch2.depth,
+        sketch2.seed,
+    ):
+        raise ValueError(
+            "Only sketches with the same dimensions and seed can be merged"
+        )
+    sketch1.table += sketch2.table
+    sketch1.total += sketch2.total
+
+
+# Largest overestimate as a share of the total count, and the probability it holds
+def get_sketch_error(sketch: CountMinSketch) -> tuple[float, float]:
+    return (math.e / sketch.width, 1 - math.exp(-sketch.depth))
+
+
+# Smallest power of two width whose error share is at most `share`
+def get_sketch_width(share: float) -> int:
+    return 1 << math.ceil(math.log2(math.e / share))
@@ -0,0 +1,129 @@
+from collections import Counter
+from typing import Optional
+from symbols import pinyin_initials
+
+# Mandarin only has about 420 syllables, so every syllable pypinyin can produce is
+# split into its initial and final once, and text is split with lookups into that
+# table. Syllables that are not in the table are counted instead of being split.
+
+# Digraphs are matched before the letter they start with
+digraph_initials = [initial for initial in pinyin_initials if len(initial) == 2]
+single_initials = [initial for initial in pinyin_initials if len(initial) == 1]
+
+
+# Split a syllable (without tone) into its initial and final.
+# Zero-consonant finals are tagged with "F".
+def split_syllable(syllable: str) -> tuple[str, ...]:
+    for initial in digraph_initials:
+        if syllable.startswith(initial):
+            break
+    else:
+        initial = syllable[:1] if syllable[:1] in single_initials else ""
+    if not initial:
+        return (syllable + "F",)
+    final = syllable[len(initial) :]
+    return (initial, final) if final else (initial,)
+
+
+# The syllables of every character pypinyin knows, in the style lazy_pinyin converts to
+def get_pinyin_syllables() -> set[str]:
+    from pypinyin.contrib.tone_convert import to_normal
+    from pypinyin.pinyin_dict import pinyin_dict
+
+    return {
+        to_normal(pinyin, v_to_u=False)
+        for pinyins in pinyin_dict.values()
+        for pinyin in pinyins.split(",")
+    }
+
+
+syllable_table: Optional[dict[str, tuple[str, ...]]] = None
+
+
+# Built on first use since pypinyin takes a moment to import
+def get_syllable_table() -> dict[str, tuple[str, ...]]:
+    global syllable_table
+    if syllable_table is None:
+        syllable_table = {
+            syllable: split_syllable(syllable)
+            for syllable in sorted(get_pinyin_syllables())
+        }
+    return syllable_table
+
+
+toned_syllable_table: Optional[
+    dict[str, tuple[tuple[str, ...], tuple[str, ...]]]
+] = None
+
+
+# Syllables with a tone number (eg. "zhong1", 5 for the neutral tone) or without
+# one, split into their initial and final and into their initial and toned final
+def get_toned_syllable_table() -> dict[str, tuple[tuple[str, ...], tuple[str, ...]]]:
+    global toned_syllable_table
+    if toned_syllable_table is None:
+        toned_syllable_table = {
+            syllable
+            + tone: (
+                components,
+                components[:-1] + (components[-1] + tone,),
+            )
+            for syllable, components in get_syllable_table().items()
+            for tone in ["", "1", "2", "3", "4", "5"]
+        }
+    return toned_syllable_table
+
+
+# Syllables this process could not split since the last take_unknown_syllables
+unknown_syllables: Counter = Counter()
+
+
+def split_syllables(syllables: list[str]) -> list[str]:
+    table = get_syllable_table()
+    components = []
+    for syllable in syllables:
+        syllable_components = table.get(syllable)
+        if syllable_components is None:
+            unknown_syllables[syllable] += 1
+        else:
+            components += syllable_components
+    return components
+
+
+def take_unknown_syllables() -> dict[str, int]:
+    taken = dict(unknown_syllables)
+    unknown_syllables.clear()
+    return taken
+
+
+# The components of toned syllables, without and with their tones
+def split_toned_syllables(syllables: list[str]) -> tuple[list[str], list[str]]:
+    table = get_toned_syllable_table()
+    components = []
+    toned_components = []
+    for syllable in syllables:
+        syllable_components = table.get(syllable)
+        if syllable_components is None:
+            unknown_syllables[syllable] += 1
+        else:
+            components += syllable_components[0]
+            toned_components += syllable_components[1]
+    return (components, toned_components)
+
+
+pinyin_dict: Optional[dict[int, str]] = None
+
+
+# pypinyin's dictionary of the syllables of every character by code point
+def get_pinyin_dict() -> dict[int, str]:
+    global pinyin_dict
+    if pinyin_dict is None:
+        from pypinyin.pinyin_dict import pinyin_dict as pypinyin_dict
+
+        pinyin_dict = pypinyin_dict
+    return pinyin_dict
+
+
+# The characters of a text that pypinyin converts to a syllable
+def get_pinyin_characters(text: str) -> list[str]:
+    characters = get_pinyin_dict()
+    return [character for character in text if ord(character) in characters]
@@ -0,0 +1,365 @@
+import numpy as np
+from dataclasses import dataclass, field
+from collections import defaultdict
+from itertools import chain
+from typing import Iterable, Optional
+from ngrams import (
+    NgramCounts,
+    add_ngram_counts,
+    count_ngrams,
+    get_empty_ngram_counts,
+    get_named_ngram_counts,
+    ngram_counts_from_arrays,
+    ngram_counts_to_arrays,
+)
+from text_counts import (
+    TextCounts,
+    add_text_counts,
+    get_empty_text_counts,
+    text_counts_from_arrays,
+    text_counts_to_arrays,
+)
+
+# Closed alphabet of the components produced by splitting Pinyin syllables
+# into an initial and a final. Zero-consonant finals are tagged with "F".
+
+pinyin_initials: list[str] = [
+    "b",
+    "p",
+    "m",
+    "f",
+    "d",
+    "t",
+    "n",
+    "l",
+    "g",
+    "k",
+    "h",
+    "j",
+    "q",
+    "x",
+    "zh",
+    "ch",
+    "sh",
+    "r",
+    "z",
+    "c",
+    "s",
+    "y",
+    "w",
+]
+
+# "m" is left out because it is already an initial,
+# the final "m" of the interjection "hm" shares its symbol
+pinyin_finals: list[str] = [
+    "a",
+    "o",
+    "e",
+    "i",
+    "u",
+    "v",
+    "ai",
+    "ei",
+    "ao",
+    "ou",
+    "an",
+    "en",
+    "ang",
+    "eng",
+    "ong",
+    "ia",
+    "ie",
+    "iao",
+    "iu",
+    "ian",
+    "in",
+    "iang",
+    "ing",
+    "iong",
+    "ua",
+    "uo",
+    "uai",
+    "ui",
+    "uan",
+    "un",
+    "uang",
+    "ue",
+    "ve",
+    "ng",
+]
+
+pinyin_zero_consonant_finals: list[str] = [
+    "aF",
+    "oF",
+    "eF",
+    "aiF",
+    "eiF",
+    "aoF",
+    "ouF",
+    "anF",
+    "enF",
+    "angF",
+    "engF",
+    "erF",
+]
+
+
+@dataclass(frozen=True)
+class SymbolTable:
+    symbols: list[str]
+    ids: dict[str, int] = field(init=False)
+
+    def __post_init__(self):
+        object.__setattr__(
+            self, "ids", {symbol: i for i, symbol in enumerate(self.symbols)}
+        )
+
+    def __len__(self):
+        return len(self.symbols)
+
+
+symbol_table = SymbolTable(
+    pinyin_initials + pinyin_finals + pinyin_zero_consonant_finals
+)
+
+
+# Frequencies over the symbol table as dense arrays:
+# single_counts[i] counts symbol i and pair_counts[i, j] counts symbol i followed by j.
+# Components outside the table are still counted exactly, by name, in the overflow dicts.
+@dataclass
+class ArrayFreqs:
+    single_counts: np.ndarray = field(
+        default_factory=lambda: np.zeros(len(symbol_table), dtype=np.int64)
+    )
+    pair_counts: np.ndarray = field(
+        default_factory=lambda: np.zeros(
+            (len(symbol_table), len(symbol_table)), dtype=np.int64
+        )
+    )
+    overflow_single_counts: dict[str, int] = field(
+        default_factory=lambda: defaultdict(int)
+    )
+    overflow_pair_counts: dict[tuple[str, str], int] = field(
+        default_factory=lambda: defaultdict(int)
+    )
+    # Counts of longer n-grams, only collected when asked for
+    ngram_counts: Optional[NgramCounts] = None
+    # Toned, syllable and character counts, only collected when asked for
+    text_counts: Optional[TextCounts] = None
+
+
+def count_components(components: list[str], freqs: ArrayFreqs):
+    count_component_lines([components], freqs)
+
+
+# Count the components of many lines, eg. all lines of a chunk, with one bincount
+# over the whole batch instead of one 69 x 69 bincount per line.
+# Pairs are only counted within a line.
+def count_component_lines(lines: Iterable[list[str]], freqs: ArrayFreqs):
+    line_ids = []
+    for components in lines:
+        ids = [symbol_table.ids.get(component, -1) for component in components]
+        if freqs.ngram_counts is not None:
+            count_ngrams(np.array(ids, dtype=np.int64), freqs.ngram_counts)
+        if -1 in ids:
+            count_components_with_overflow(components, ids, freqs)
+        elif ids:
+            line_ids.append(ids)
+    if not line_ids:
+        return
+    num_symbols = len(symbol_table)
+    id_array = np.fromiter(chain.from_iterable(line_ids), dtype=np.intp)
+    is_line_start = np.zeros(len(id_array), dtype=bool)
+    is_line_start[np.cumsum([len(ids) for ids in line_ids[:-1]], dtype=np.intp)] = True
+    is_pair = ~is_line_start[1:]
+    freqs.single_counts += np.bincount(id_array, minlength=num_symbols)
+    freqs.pair_counts += np.bincount(
+        id_array[:-1][is_pair] * num_symbols + id_array[1:][is_pair],
+        minlength=num_symbols**2,
+    ).reshape(num_symbols, num_symbols)
+
+
+def count_components_with_overflow(
+    components: list[str], ids: list[int], freqs: ArrayFreqs
+):
+    for i, (component, symbol_id) in enumerate(zip(components, ids)):
+        if symbol_id >= 0:
+            freqs.single_counts[symbol_id] += 1
+        else:
+            freqs.overflow_single_counts[component] += 1
+        if i > 0:
+            previous_id = ids[i - 1]
+            if previous_id >= 0 and symbol_id >= 0:
+                freqs.pair_counts[previous_id, symbol_id] += 1
+            else:
+                freqs.overflow_pair_counts[(components[i - 1], component)] += 1
+
+
+# Add the counts of `freqs2` to `freqs1` in place
+def add_array_freqs(freqs1: ArrayFreqs, freqs2: ArrayFreqs):
+    freqs1.single_counts += freqs2.single_counts
+    freqs1.pair_counts += freqs2.pair_counts
+    for key, count in freqs2.overflow_single_counts.items():
+        freqs1.overflow_single_counts[key] += count
+    for key, count in freqs2.overflow_pair_counts.items():
+        freqs1.overflow_pair_counts[key] += count
+    if freqs2.ngram_counts is not None:
+        if freqs1.ngram_counts is None:
+            freqs1.ngram_counts = get_empty_ngram_counts(freqs2.ngram_counts)
+        add_ngram_counts(freqs1.ngram_counts, freqs2.ngram_counts)
+    if freqs2.text_counts is not None:
+        if freqs1.text_counts is None:
+            freqs1.text_counts = get_empty_text_counts(freqs2.text_counts)
+        add_text_counts(freqs1.text_counts, freqs2.text_counts)
+
+
+# Counts keyed by symbol names, leaving out symbols that never occurred
+def get_single_counts(freqs: ArrayFreqs) -> dict[str, int]:
+    counts = {
+        symbol_table.symbols[i]: int(freqs.single_counts[i])
+        for i in np.flatnonzero(freqs.single_counts)
+    }
+    for key, count in freqs.overflow_single_counts.items():
+        counts[key] = counts.get(key, 0) + count
+    return counts
+
+
+def get_pair_counts(freqs: ArrayFreqs) -> dict[tuple[str, str], int]:
+    counts = {
+        (symbol_table.symbols[i], symbol_table.symbols[j]): int(freqs.pair_counts[i, j])
+        for i, j in zip(*np.nonzero(freqs.pair_counts))
+    }
+    for key, count in freqs.overflow_pair_counts.items():
+        counts[key] = counts.get(key, 0) + count
+    return counts
+
+
+def get_ngram_counts(freqs: ArrayFreqs) -> dict[tuple[str, ...], int]:
+    if freqs.ngram_counts is None:
+        return {}
+    return get_named_ngram_counts(freqs.ngram_counts, symbol_table.symbols)
+
+
+# Add counts keyed by symbol names, counting the symbols outside the table in the overflow dicts
+def add_named_counts(
+    freqs: ArrayFreqs,
+    single_counts: dict[str, int],
+    pair_counts: dict[tuple[str, str], int],
+):
+    for key, count in single_counts.items():
+        symbol_id = symbol_table.ids.get(key)
+        if symbol_id is not None:
+            freqs.single_counts[symbol_id] += count
+        else:
+            freqs.overflow_single_counts[key] += count
+    for (first, second), count in pair_counts.items():
+        (first_id, second_id) = (
+            symbol_table.ids.get(first),
+            symbol_table.ids.get(second),
+        )
+        if first_id is not None and second_id is not None:
+            freqs.pair_counts[first_id, second_id] += count
+        else:
+            freqs.overflow_pair_counts[(first, second)] += count
+
+
+# Plain arrays that np.savez can store without pickling
+def array_freqs_to_arrays(freqs: ArrayFreqs) -> dict[str, np.ndarray]:
+    overflow_pairs = list(freqs.overflow_pair_counts.items())
+    ngram_arrays = (
+        ngram_counts_to_arrays(freqs.ngram_counts)
+        if freqs.ngram_counts is not None
+        else {}
+    )
+    text_arrays = (
+        text_counts_to_arrays(freqs.text_counts)
+        if freqs.text_counts is not None
+        else {}
+    )
+    return {
+        **ngram_arrays,
+        **text_arrays,
+        "symbols": np.array(symbol_table.symbols, dtype=str),
+        "single_counts": freqs.single_counts,
+        "pair_counts": freqs.pair_counts,
+        "overflow_single_symbols": np.array(
+            list(freqs.overflow_single_counts.keys()), dtype=str
+        ),
+        "overflow_single_counts": np.array(
+            list(freqs.overflow_single_counts.values()), dtype=np.int64
+        ),
+        "overflow_pair_symbols": np.array(
+            [list(pair) for (pair, _) in overflow_pairs], dtype=str
+        ).reshape(-1, 2),
+        "overflow_pair_counts": np.array(
+            [count for (_, count) in overflow_pairs], dtype=np.int64
+        ),
+    }
+
+
+# Inverse of array_freqs_to_arrays. Arrays written with a different symbol table
+# are mapped onto the current one by symbol name.
+def array_freqs_from_arrays(arrays) -> ArrayFreqs:
+    freqs = ArrayFreqs()
+    symbols = [str(symbol) for symbol in arrays["symbols"]]
+    if "ngram_size" in arrays:
+        freqs.ngram_counts = ngram_counts_from_arrays(
+            arrays,
+            len(symbol_table),
+            None
+            if symbols == symbol_table.symbols
+            else [symbol_table.ids.get(symbol, -1) for symbol in symbols],
+        )
+    if "text_tones" in arrays:
+        freqs.text_counts = text_counts_from_arrays(arrays)
+    if symbols == symbol_table.symbols:
+        freqs.single_counts += arrays["single_counts"]
+        freqs.pair_counts += arrays["pair_counts"]
+    else:
+        single_counts = arrays["single_counts"]
+        pair_counts = arrays["pair_counts"]
+        add_named_counts(
+            freqs,
+            {symbols[i]: int(single_counts[i]) for i in np.flatnonzero(single_counts)},
+            {
+                (symbols[i], symbols[j]): int(pair_counts[i, j])
+                for i, j in zip(*np.nonzero(pair_counts))
+            },
+        )
+    add_named_counts(
+        freqs,
+        {
+            str(key): int(count)
+            for key, count in zip(
+                arrays["overflow_single_symbols"], arrays["overflow_single_counts"]
+            )
+        },
+        {
+            (str(first), str(second)): int(count)
+            for (first, second), count in zip(
+                arrays["overflow_pair_symbols"], arrays["overflow_pair_counts"]
+            )
+        },
+    )
+    return freqs
+
+
+# Raw counts files hold the symbol table, the totals and all counts, so that the
+# counts of any number of runs can be summed without losing anything
+def save_array_freqs(file, freqs: ArrayFreqs, **extra_arrays):
+    np.savez(
+        file,
+        single_total=np.int64(
+            freqs.single_counts.sum() + sum(freqs.overflow_single_counts.values())
+        ),
+        pair_total=np.int64(
+            freqs.pair_counts.sum() + sum(freqs.overflow_pair_counts.values())
+        ),
+        **array_freqs_to_arrays(freqs),
+        **extra_arrays
+    )
+
+
+def load_array_freqs(file) -> ArrayFreqs:
+    with np.load(file) as arrays:
+        return array_freqs_from_arrays(arrays)
@@ -0,0 +1,111 @@
+import numpy as np
+from collections import defaultdict
+from dataclasses import dataclass, field
+
+# Counts collected in the same pass as the initials and finals when asked for:
+# initials and tone-annotated finals (eg. "zh", "ong1") and the pairs of them typed
+# in a row, and the frequencies of syllables and of characters. The keys are open
+# ended, so everything is counted by name and merged by adding up the dicts.
+
+
+@dataclass
+class TextCounts:
+    tones: bool = False
+    characters: bool = False
+    toned_single_counts: dict[str, int] = field(
+        default_factory=lambda: defaultdict(int)
+    )
+    toned_pair_counts: dict[tuple[str, str], int] = field(
+        default_factory=lambda: defaultdict(int)
+    )
+    # Syllables with their tone when counting tones
+    syllable_counts: dict[str, int] = field(default_factory=lambda: defaultdict(int))
+    character_counts: dict[str, int] = field(default_factory=lambda: defaultdict(int))
+
+
+def get_empty_text_counts(counts: TextCounts) -> TextCounts:
+    return TextCounts(counts.tones, counts.characters)
+
+
+# Count a line given its characters that have a Pinyin, its toned syllables
+# (eg. "zhong1") and its initials and toned finals
+def count_text(
+    characters: list[str],
+    syllables: list[str],
+    toned_components: list[str],
+    counts: TextCounts,
+):
+    if counts.tones:
+        for i, component in enumerate(toned_components):
+            counts.toned_single_counts[component] += 1
+            if i > 0:
+                counts.toned_pair_counts[(toned_components[i - 1], component)] += 1
+    if counts.characters:
+        for character in characters:
+            counts.character_counts[character] += 1
+        for syllable in syllables if counts.tones else strip_tones(syllables):
+            counts.syllable_counts[syllable] += 1
+
+
+def strip_tones(syllables: list[str]) -> list[str]:
+    return [syllable.rstrip("12345") for syllable in syllables]
+
+
+def add_counts(counts1: dict, counts2: dict):
+    for key, count in counts2.items():
+        counts1[key] += count
+
+
+# Add the counts of `counts2` to `counts1` in place
+def add_text_counts(counts1: TextCounts, counts2: TextCounts):
+    if (counts1.tones, counts1.characters) != (counts2.tones, counts2.characters):
+        raise ValueError("Cannot add text counts of different kinds")
+    add_counts(counts1.toned_single_counts, counts2.toned_single_counts)
+    add_counts(counts1.toned_pair_counts, counts2.toned_pair_counts)
+    add_counts(counts1.syllable_counts, counts2.syllable_counts)
+    add_counts(counts1.character_counts, counts2.character_counts)
+
+
+def keys_to_array(counts: dict) -> np.ndarray:
+    return np.array(list(counts.keys()), dtype=str)
+
+
+def counts_to_array(counts: dict) -> np.ndarray:
+    return np.array(list(counts.values()), dtype=np.int64)
+
+
+def text_counts_to_arrays(counts: TextCounts) -> dict[str, np.ndarray]:
+    toned_pairs = list(counts.toned_pair_counts.items())
+    return {
+        "text_tones": np.bool_(counts.tones),
+        "text_characters": np.bool_(counts.characters),
+        "toned_single_symbols": keys_to_array(counts.toned_single_counts),
+        "toned_single_counts": counts_to_array(counts.toned_single_counts),
+        "toned_pair_symbols": np.array(
+            [list(pair) for (pair, _) in toned_pairs], dtype=str
+        ).reshape(-1, 2),
+        "toned_pair_counts": np.array(
+            [count for (_, count) in toned_pairs], dtype=np.int64
+        ),
+        "syllables": keys_to_array(counts.syllable_counts),
+        "syllable_counts": counts_to_array(counts.syllable_counts),
+        "characters": keys_to_array(counts.character_counts),
+        "character_counts": counts_to_array(counts.character_counts),
+    }
+
+
+def text_counts_from_arrays(arrays) -> TextCounts:
+    counts = TextCounts(bool(arrays["text_tones"]), bool(arrays["text_characters"]))
+    for key, count in zip(
+        arrays["toned_single_symbols"], arrays["toned_single_counts"]
+    ):
+        counts.toned_single_counts[str(key)] += int(count)
+    for (first, second), count in zip(
+        arrays["toned_pair_symbols"], arrays["toned_pair_counts"]
+    ):
+        counts.toned_pair_counts[(str(first), str(second))] += int(count)
+    for key, count in zip(arrays["syllables"], arrays["syllable_counts"]):
+        counts.syllable_counts[str(key)] += int(count)
+    for key, count in zip(arrays["characters"], arrays["character_counts"]):
+        counts.character_counts[str(key)] += int(count)
+    return counts
@@ -2,9 +2,9 @@ import time
 import random
 
 
-def measure(func, *args):
+def measure(func, *args, **kwargs):
     time_start = time.time()
-    result = func(*args)
+    result = func(*args, **kwargs)
     time_end = time.time()
     print(
         "{name} took {time:.0f}s.".format(
@@ -0,0 +1,77 @@
+import json
+import os
+from collections import OrderedDict
+from typing import Optional
+
+Components = tuple[str, ...]
+
+
+# Bounded LRU cache from a segmented word to its sequence of initials and finals.
+# Chinese text has a heavily skewed vocabulary, so a few thousand words
+# account for most of the lookups.
+class WordCache:
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self.entries: OrderedDict[str, Components] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        # Words put since the last take_added(), so that workers only send
+        # back the words they converted instead of their whole cache
+        self.added_words: set[str] = set()
+
+    def get(self, word: str) -> Optional[Components]:
+        components = self.entries.get(word)
+        if components is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+            self.entries.move_to_end(word)
+        return components
+
+    def put(self, word: str, components: Components):
+        if self.max_size <= 0:
+            return
+        self.entries[word] = components
+        self.entries.move_to_end(word)
+        self.added_words.add(word)
+        if len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+    def update(self, entries: dict[str, Components]):
+        for word, components in entries.items():
+            self.put(word, components)
+
+    # Entries of the words put since the last call that are still cached
+    def take_added(self) -> dict[str, Components]:
+        added = {
+            word: self.entries[word]
+            for word in self.added_words
+            if word in self.entries
+        }
+        self.added_words = set()
+        return added
+
+
+def get_hit_rate(hits: int, misses: int) -> float:
+    return hits / (hits + misses) * 100 if hits + misses > 0 else 0.0
+
+
+# Warm a cache from the words persisted by a previous run
+def load_word_cache(path: Optional[str], max_size: int) -> WordCache:
+    cache = WordCache(max_size)
+    if path is not None and os.path.exists(path):
+        with open(path, "r") as infile:
+            cache.update(
+                {
+                    word: tuple(components)
+                    for word, components in json.load(infile).items()
+                }
+            )
+        # The loaded words are already in the file
+        cache.take_added()
+    return cache
+
+
+def save_word_cache(cache: WordCache, path: str):
+    with open(path, "w+") as outfile:
+        json.dump(dict(cache.entries), outfile, ensure_ascii=False)
@@ -0,0 +1,6 @@
+import os
+import sys
+
+# The scripts in src import each other as siblings
+src_dir = os.path.join(os.path.dirname(os.path.dirname(__file__)), "src")
+sys.path.insert(0, src_dir)
@@ -0,0 +1,72 @@
+import json
+import numpy as np
+import pytest
+from compute_frequencies import CountOptions, merge_counts, parallel_count
+from symbols import ArrayFreqs, array_freqs_to_arrays, save_array_freqs
+
+fields = ["title", "desc", "content"]
+
+sentences = [
+    "今天天气很好，我们一起去公园散步吧。",
+    "这个问题的答案取决于你怎么理解双拼输入法。",
+    "知乎是一个中文互联网问答社区。",
+    "学习编程需要耐心和大量的练习。",
+    "他在北京大学读书，专业是计算机科学。",
+    "春眠不觉晓，处处闻啼鸟。",
+    "请问有没有人知道这家餐厅的营业时间？",
+]
+
+
+@pytest.fixture
+def corpus(tmp_path):
+    file_name = tmp_path / "corpus.json"
+    with open(file_name, "w") as f:
+        for i in range(120):
+            record = {
+                "title": sentences[i % len(sentences)],
+                "desc": sentences[(i * 3) % len(sentences)] * (i % 3),
+                "content": "".join(sentences[j % len(sentences)] for j in range(i % 5)),
+            }
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+    return str(file_name)
+
+
+def get_options(**kwargs) -> CountOptions:
+    # Small chunks so that the file is split into several of them
+    return CountOptions(segmenter="character", workers=2, chunk_size=2000, **kwargs)
+
+
+def assert_same_counts(counts: ArrayFreqs, expected: ArrayFreqs):
+    arrays = array_freqs_to_arrays(counts)
+    expected_arrays = array_freqs_to_arrays(expected)
+    assert arrays.keys() == expected_arrays.keys()
+    for key, array in expected_arrays.items():
+        assert np.array_equal(arrays[key], array), key
+
+
+def test_parts_and_resume_equal_single_run(corpus, tmp_path):
+    full = parallel_count(corpus, fields, get_options())
+    assert full.single_counts.sum() > 0
+    checkpoint_dir = str(tmp_path / "checkpoints")
+    for index in range(2):
+        parallel_count(
+            corpus,
+            fields,
+            get_options(checkpoint_dir=checkpoint_dir, part=(index, 2)),
+        )
+    resumed = parallel_count(
+        corpus, fields, get_options(checkpoint_dir=checkpoint_dir, resume=True)
+    )
+    assert_same_counts(resumed, full)
+
+
+def test_merge_of_parts_equals_full_counts(corpus, tmp_path):
+    full = parallel_count(corpus, fields, get_options())
+    file_names = []
+    for index in range(3):
+        file_name = str(tmp_path / "counts_{}.npz".format(index))
+        save_array_freqs(
+            file_name, parallel_count(corpus, fields, get_options(part=(index, 3)))
+        )
+        file_names.append(file_name)
+    assert_same_counts(merge_counts(file_names), full)
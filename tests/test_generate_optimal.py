@@ -0,0 +1,64 @@
+import os
+import random
+import numpy as np
+import pytest
+from frequency_profiles import load_json_profile
+from generate_optimal import (
+    cache_scores,
+    crossover,
+    default_initial_constraints,
+    encode_chromosomes,
+    get_engine,
+    get_random_chromosome,
+    pack_chromosomes,
+    rescore_child,
+    score_population,
+    unpack_chromosomes,
+    use_profile,
+)
+
+profile_dir = os.path.join(
+    os.path.dirname(os.path.dirname(__file__)), "results", "zhihu", "frequencies"
+)
+
+
+@pytest.fixture(scope="module", autouse=True)
+def zhihu_engine():
+    use_profile(load_json_profile(profile_dir))
+    yield
+    use_profile(None)
+
+
+def get_random_chromosomes(count, seed):
+    random.seed(seed)
+    return [get_random_chromosome() for _ in range(count)]
+
+
+def test_pack_unpack_round_trip():
+    chromosomes = get_random_chromosomes(200, 0)
+    packed = pack_chromosomes(chromosomes)
+    assert packed.dtype == np.int8
+    assert unpack_chromosomes(packed) == chromosomes
+
+
+def test_rescore_child_equals_full_score():
+    parents = get_random_chromosomes(20, 1)
+    for receiver in parents:
+        for donor in parents:
+            child = crossover(receiver, donor, default_initial_constraints)
+            rescore_child(receiver, child)
+            full_cache = cache_scores(get_engine(), encode_chromosomes([child])[0])
+            assert np.allclose(
+                child.score_cache.scores, full_cache.scores, rtol=0, atol=1e-12
+            )
+            assert child.score == pytest.approx(full_cache.score, rel=0, abs=1e-12)
+
+
+def test_score_population_equals_single_scores():
+    chromosomes = get_random_chromosomes(50, 2)
+    scores = score_population(chromosomes)
+    full_scores = [
+        cache_scores(get_engine(), slot_keys).score
+        for slot_keys in encode_chromosomes(chromosomes)
+    ]
+    assert np.allclose(scores, full_scores, rtol=0, atol=1e-12)